@@ -293,7 +293,7 @@ from mirtask import keys, util
 __version_info__ = (1, 0)
 IDENT = '$Id$'
 
-## quickutil: arraygrower statsacc words
+## quickutil: arraygrower words
 #- snippet: arraygrower.py (2012 Mar 29)
 #- SHA1: 0524398a658fe9cbf9b3ba557e16018f89e5027d
 class ArrayGrower (object):
@@ -349,59 +349,6 @@ class ArrayGrower (object):
 
         self.clear ()
         return ret
-#- snippet: statsacc.py (2012 Mar 29)
-#- SHA1: dd61a34a90a30faf9accb67a1f685c2015c4a958
-class StatsAccumulator (object):
-    __slots__ = 'xtot xsqtot n _shape'.split ()
-
-    def __init__ (self, shape=None):
-        self._shape = shape
-        self.clear ()
-
-    def clear (self):
-        if self._shape is None:
-            self.xtot = 0.
-            self.xsqtot = 0.
-        else:
-            from numpy import zeros
-            self.xtot = zeros (self.shape)
-            self.xsqtot = zeros (self.shape)
-        self.n = 0
-        return self
-
-    def add (self, x):
-        if self._shape is not None:
-            from numpy import asarray
-            x = asarray (x)
-            if x.shape != self._shape:
-                raise ValueError ('x has wrong shape')
-        self.xtot += x
-        self.xsqtot += x**2
-        self.n += 1
-        return self
-
-    def num (self):
-        return self.n
-
-    def mean (self):
-        return self.xtot / self.n
-
-    def rms (self):
-        if self._shape is None:
-            from math import sqrt
-        else:
-            from numpy import sqrt
-        return sqrt (self.xsqtot / self.n)
-
-    def std (self):
-        if self._shape is None:
-            from math import sqrt
-        else:
-            from numpy import sqrt
-        return sqrt (self.var ())
-
-    def var (self):
-        return self.xsqtot / self.n - (self.xtot / self.n)**2
 #- snippet: words.py (2012 Mar 29)
 #- SHA1: 5ba0c8c0085d1800ba46e7d5f5dd1dff9cd43a24
 def words (linegen):
@@ -537,129 +484,94 @@ class SysTemps (object):
         self._flattenAps ()
 
     def _flattenAps (self):
-        index = self.aps.index
-
-        for i in self.idxs:
-            row = self.ants[i]
-            row[0] = index (row[0])
-            row[1] = index (row[1])
+        # Convert antpol numbers into indices into self.aps
+        self.ants = np.searchsorted (self.aps, self.ants)
 
     def _computeBPSysTemps (self, jyperk, sdf):
         # Compute per-baseline tsyses
         flux = self.flux
-        etaQ = self.etaQ
-        tsyses = self.tsyses
-
-        for i in self.idxs:
-            mreal, sreal, mimag, simag, meantime, tmp1 = self.info[i]
-            s = (sreal + simag) / 2
-
-            if flux is None:
-                gain = 1
-            else:
-                gain = flux / np.sqrt (mreal**2 + mimag**2)
-
-            tsys = gain * s * etaQ * np.sqrt (2 * sdf * 1e9 * meantime) / jyperk
+        mreal, sreal, mimag, simag, meantime = self.info[:,:5].T
+        s = (sreal + simag) / 2
 
-            #if tsys > 300:
-                #    print '  Crappy %s: TSys = %g' % (util.fmtBP (bp), tsys)
-                #    print '    real: s, D, p:', sreal, Dr, pr
-                #    print '    imag: s, D, p:', simag, Di, pi
-                #    continue
-
-            tsyses[i] = tsys
+        if flux is None:
+            gain = 1
+        else:
+            gain = flux / np.sqrt (mreal**2 + mimag**2)
 
-    def _reflattenFiltered (self, skipAps, skipBps):
-        # prefix: o = old, n = new
+        self.tsyses[:] = gain * s * self.etaQ * \
+            np.sqrt (2 * sdf * 1e9 * meantime) / jyperk
 
-        seenAps = set ()
-        naginfo = ArrayGrower (6, np.double)
-        nagants = ArrayGrower (2, np.int)
-        oAnts = self.ants
-        oAps = self.aps
+    def _filter (self, skipAps, skipBps):
+        # Drop the specified basepols and antpols in place, then
+        # renumber the antpols that remain.
 
-        # Copy old data
+        aps = np.asarray (self.aps)
+        a1 = aps[self.ants[:,0]]
+        a2 = aps[self.ants[:,1]]
 
-        for i in self.idxs:
-            oa1, oa2 = oAnts[i]
-            a1, a2 = oAps[oa1], oAps[oa2]
-            if (a1, a2) in skipBps: continue
-            if a1 in skipAps or a2 in skipAps: continue
+        drop = np.in1d (a1, skipAps) | np.in1d (a2, skipAps)
+        for bp1, bp2 in skipBps:
+            drop |= (a1 == bp1) & (a2 == bp2)
 
-            naginfo.addLine (self.info[i])
-            nagants.add (a1, a2)
-            seenAps.add (a1)
-            seenAps.add (a2)
+        keep = np.where (~drop)[0]
+        assert keep.size > 0, 'Skipped all antpols!'
 
-        info = naginfo.finish ()
-        ants = nagants.finish ()
+        info = self.info[keep]
+        ants = self.ants[keep]
+        used = np.unique (ants)
+        renumber = np.empty (len (self.aps), dtype=np.int)
+        renumber[used] = np.arange (used.size)
 
-        assert len (info) > 0, 'Skipped all antpols!'
-
-        self.aps = aps = sorted (seenAps)
+        self.aps = aps[used].tolist ()
         self.nbp = len (info)
-        self.nap = len (seenAps)
-        self.idxs = idxs = xrange (0, self.nbp)
+        self.nap = used.size
+        self.idxs = xrange (0, self.nbp)
         self.info = info
-        self.ants = ants
+        self.ants = renumber[ants]
         self.tsyses = info[:,5]
 
-        self._flattenAps ()
-
     def _solve (self):
-        from mirtask.util import linLeastSquares
-
-        idxs = self.idxs
-        ants = self.ants
+        a1, a2 = self.ants.T
+        nap = self.nap
         tsyses = self.tsyses
 
         # T_ij = sqrt (T_i T_j)
         # square and take logarithm:
         # 2 * log (T_ij) = log (T_i) + log (T_j)
         #
-        # transform problem into log space and populate
-        # the data matrices for the solver.
-
-        coeffs = np.zeros ((self.nap, self.nbp))
-
-        for i in idxs:
-            a1, a2 = ants[i]
-            coeffs[a1,i] = 1
-            coeffs[a2,i] = 1
+        # transform problem into log space and solve the normal
+        # equations. The design matrix has exactly two ones per
+        # basepol, so the normal matrix is just the number of
+        # basepols linking each pair of antpols, and we never need
+        # to build the (nap, nbp) design matrix.
 
         vals = 2 * np.log (tsyses)
 
-        logTs = linLeastSquares (coeffs, vals)
+        ncontrib = (np.bincount (a1, minlength=nap) +
+                    np.bincount (a2, minlength=nap))
+        normal = np.zeros ((nap, nap))
+        np.add.at (normal, (a1, a2), 1)
+        normal += normal.T
+        normal[np.diag_indices (nap)] = ncontrib
+
+        rhs = (np.bincount (a1, weights=vals, minlength=nap) +
+               np.bincount (a2, weights=vals, minlength=nap))
 
+        logTs = np.linalg.solve (normal, rhs)
         self.soln = soln = np.exp (logTs)
 
         # Populate useful arrays.
 
-        self.model = model = np.ndarray (self.nbp)
-
-        for i in idxs:
-            a1, a2 = ants[i]
-            model[i] = soln[a1] * soln[a2]
-
-        np.sqrt (model, model)
-
-        self.resid = tsyses - model
-        self.rchisq = (self.resid**2).sum () / (self.nbp - self.nap)
+        self.model = model = np.sqrt (soln[a1] * soln[a2])
+        self.resid = resid = tsyses - model
+        self.rchisq = (resid**2).sum () / (self.nbp - self.nap)
         print '   Pseudo-RChiSq:', self.rchisq
 
-        self.rms = rms = np.ndarray (self.nap)
-        self.ncontrib = ncontrib = np.zeros (self.nap)
-
-        sa = StatsAccumulator ()
-
-        for i in xrange (self.nap):
-            sa.clear ()
-            for j in self.idxs:
-                if i not in ants[j]:
-                    continue
-                sa.add (self.resid[j])
-                ncontrib[i] += 1
-            rms[i] = sa.rms ()
+        rsq = resid**2
+        sumsq = (np.bincount (a1, weights=rsq, minlength=nap) +
+                 np.bincount (a2, weights=rsq, minlength=nap))
+        self.ncontrib = ncontrib.astype (np.double)
+        self.rms = np.sqrt (sumsq / ncontrib)
 
 
     def _print (self):
@@ -797,12 +709,11 @@ class SysTemps (object):
             badBps = []
             badAps = []
 
-            for i in self.idxs:
-                if abs (self.resid[i]) > self.maxresid:
-                    a1, a2 = self.ants[i]
-                    bp = (self.aps[a1], self.aps[a2])
-                    badBps.append ((bp, self.resid[i]))
-                    allBadBps.add (bp)
+            for i in np.where (np.abs (self.resid) > self.maxresid)[0]:
+                a1, a2 = self.ants[i]
+                bp = (self.aps[a1], self.aps[a2])
+                badBps.append ((bp, self.resid[i]))
+                allBadBps.add (bp)
 
             if len (badBps) == 0:
                 for i in xrange (0, self.nap):
@@ -824,8 +735,8 @@ class SysTemps (object):
                 print '      Flagging antpol %s: TSys %#4g > %#4g' % \
                       (util.fmtAP (ap), soln, self.maxtsys)
 
-            self._reflattenFiltered ([t[0] for t in badAps],
-                                     [t[0] for t in badBps])
+            self._filter ([t[0] for t in badAps],
+                          [t[0] for t in badBps])
 
         print
         self._print ()
@@ -22,6 +22,18 @@ __all__ = ('NoiseCal loadNoiseCalExport').split ()
 
 TTOL = 1./1440 # 1 minute
 
+# Saved-file format: magic, 8-byte little-endian header length, pickled
+# header, then raw arrays, each aligned to _ALIGN bytes from the start of
+# the data section, which is itself aligned. The header indexes the arrays
+# by (offset, dtype, shape). Files lacking the magic are in the original
+# format, a simple sequence of pickles.
+_FORMAT_MAGIC = 'CALNOISE'
+_FORMAT_VERSION = 2
+_ALIGN = 64
+
+def _align (n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
 ## quickutil: arraygrower vectorgrower words
 #- snippet: arraygrower.py (2012 Mar 29)
 #- SHA1: 0524398a658fe9cbf9b3ba557e16018f89e5027d
@@ -180,19 +192,78 @@ class NoiseCal (object):
     suncerts = None # formal uncertainties in the per-sample
     # solutions: n-element vector, n as in sqbps
 
-    def load (self, path, partial=False):
-        f = open (path)
+    def load (self, path, partial=False, mmap=True):
+        """Load a saved calibration. If `partial`, only the information
+        needed to apply the calibration is read. Otherwise, in the
+        current file format the (potentially large) quality-check arrays
+        are memory-mapped if `mmap` is True, so that they are only read
+        from disk as they are used. Files in the original all-pickle
+        format can also be read."""
+
+        f = open (path, 'rb')
+        magic = f.read (len (_FORMAT_MAGIC))
+
+        if magic != _FORMAT_MAGIC:
+            f.seek (0)
+            self._load_pickled (f, partial)
+            f.close ()
+            return
+
+        hlen = int (np.fromstring (f.read (8), dtype='<u8')[0])
+        header = cPickle.loads (f.read (hlen))
+        base = _align (f.tell ())
+        f.close ()
+
+        if header['version'] != _FORMAT_VERSION:
+            raise ValueError ('unsupported calnoise file version %r in "%s"'
+                              % (header['version'], path))
+
+        self.instr = header['instr']
+        self.saps = header['saps']
+        self.solution = header['solution']
+        self.covar = header['covar']
+
+        if partial:
+            return
+
+        def get (name):
+            offset, dtype, shape = header['arrays'][name]
+            size = int (np.prod (shape))
+
+            if mmap and size:
+                return np.memmap (path, dtype=dtype, mode='r',
+                                  offset=base + offset, shape=shape)
+
+            f = open (path, 'rb')
+            f.seek (base + offset)
+            a = np.fromfile (f, dtype=dtype, count=size)
+            f.close ()
+            return a.reshape (shape)
+
+        allraras = get ('raras')
+        self.raras = {}
+        for apidx, (start, stop) in header['raraspans'].iteritems ():
+            self.raras[apidx] = allraras[:,start:stop]
+
+        self.sqbps = get ('sqbps')
+        self.bpdata = get ('bpdata')
+        self.svals = get ('svals')
+        self.suncerts = get ('suncerts')
+
+
+    def _load_pickled (self, f, partial):
+        # ndarray.dump() just writes a pickle, so we can read everything
+        # with cPickle; np.load() refuses pickles in newer Numpys.
         self.instr = cPickle.load (f)
         self.saps = cPickle.load (f)
-        self.solution = np.load (f)
-        self.covar = np.load (f)
+        self.solution = cPickle.load (f)
+        self.covar = cPickle.load (f)
         if not partial:
             self.raras = cPickle.load (f)
-            self.sqbps = np.load (f)
-            self.bpdata = np.load (f)
-            self.svals = np.load (f)
-            self.suncerts = np.load (f)
-        f.close ()
+            self.sqbps = cPickle.load (f)
+            self.bpdata = cPickle.load (f)
+            self.svals = cPickle.load (f)
+            self.suncerts = cPickle.load (f)
 
 
     def printsefdinfo (self):
@@ -264,43 +335,106 @@ class NoiseCal (object):
             print >>stream, self.instr, util.fmtAP (saps[i]), '%.5e' % solution[i]
 
 
-    def compute (self, toread, **uvdatoptions):
-        for vis in toread:
-            if not os.path.exists (vis.path ('gains')):
-                util.die ('input "%s" has no gain calibration tables', vis)
+    def compute (self, toread, singlepass=False, **uvdatoptions):
+        """Compute the noise calibration from the datasets `toread`.
 
-        self._compute_getraras (toread, uvdatoptions)
-        self._compute_getbpvs (toread, uvdatoptions)
+        By default the data are read twice: once without calibration
+        to get the raw autocorrelation amplitudes (RARAs), and once
+        with calibration to get the cross-correlation variances. If
+        `singlepass` is True, both are obtained from a single
+        uncalibrated pass, halving the I/O. uvdat cannot give us raw
+        autocorrelations and calibrated cross-correlations in the
+        same pass, so this mode is only appropriate for data that
+        need no gain or bandpass corrections; the solution is then in
+        the units of the uncalibrated visibilities."""
+
+        if not singlepass:
+            for vis in toread:
+                if not os.path.exists (vis.path ('gains')):
+                    util.die ('input "%s" has no gain calibration tables', vis)
+
+        rarawork = {}
+        bpwork = ArrayGrower (2, dtype=np.int)
+        bpstats = ArrayGrower (3)
+
+        if singlepass:
+            gen = uvdat.setupAndRead (toread, '3', False,
+                                      nopass=True, nocal=True, nopol=True,
+                                      **uvdatoptions)
+            self._compute_read (gen, rarawork, bpwork, bpstats)
+        else:
+            gen = uvdat.setupAndRead (toread, 'a3', False,
+                                      nopass=True, nocal=True, nopol=True,
+                                      **uvdatoptions)
+            self._compute_read (gen, rarawork, None, None)
+            gen = uvdat.setupAndRead (toread, 'x3', False,
+                                      nopass=False, nocal=False, nopol=False,
+                                      **uvdatoptions)
+            self._compute_read (gen, None, bpwork, bpstats)
+
+        self._compute_getraras (rarawork)
+        self._compute_getbpvs (bpwork.finish (), bpstats.finish ())
         self._compute_solve ()
 
 
     def save (self, outpath):
-        f = open (outpath, 'w')
-        # Start with just the info needed to apply to noise calibration:
-        cPickle.dump (self.instr, f)
-        cPickle.dump (self.saps, f)
-        self.solution.dump (f)
-        self.covar.dump (f)
-        # Then (potentially large) extra data for checking the quality
-        # of the noise calibration:
-        cPickle.dump (self.raras, f)
-        self.sqbps.dump (f)
-        self.bpdata.dump (f)
-        self.svals.dump (f)
-        self.suncerts.dump (f)
+        # The header holds the info needed to apply to noise calibration,
+        # plus an index of the (potentially large) extra data for
+        # checking the quality of the noise calibration. The latter are
+        # written as raw arrays so that they can be memory-mapped. The
+        # raras dict is stored as one concatenated (3,n) array.
+
+        apidxs = sorted (self.raras.iterkeys ())
+        raraspans = {}
+        start = 0
+
+        for apidx in apidxs:
+            stop = start + self.raras[apidx].shape[1]
+            raraspans[apidx] = (start, stop)
+            start = stop
+
+        if len (apidxs):
+            allraras = np.concatenate ([self.raras[i] for i in apidxs], axis=1)
+        else:
+            allraras = np.empty ((3, 0))
+
+        arrays = [('raras', allraras), ('sqbps', self.sqbps),
+                  ('bpdata', self.bpdata), ('svals', self.svals),
+                  ('suncerts', self.suncerts)]
+        index = {}
+        offset = 0
+
+        for name, a in arrays:
+            index[name] = (offset, a.dtype.str, a.shape)
+            offset = _align (offset + a.nbytes)
+
+        header = dict (version=_FORMAT_VERSION, instr=self.instr,
+                       saps=self.saps, solution=self.solution,
+                       covar=self.covar, arrays=index, raraspans=raraspans)
+        header = cPickle.dumps (header, cPickle.HIGHEST_PROTOCOL)
+
+        f = open (outpath, 'wb')
+        f.write (_FORMAT_MAGIC)
+        f.write (np.asarray (len (header), dtype='<u8').tostring ())
+        f.write (header)
+        base = _align (f.tell ())
+
+        for name, a in arrays:
+            f.seek (base + index[name][0])
+            np.ascontiguousarray (a).tofile (f)
+
         f.close ()
 
 
     # The bits that actually do the calibration:
 
-    def _compute_getraras (self, toread, uvdatoptions):
-        seenaps = set ()
-        rarawork = {}
+    def _compute_read (self, gen, rarawork, bpwork, bpstats):
+        # Accumulate RARAs into `rarawork` and per-record cross-correlation
+        # statistics into `bpwork` and `bpstats`. The latter are matched up
+        # with the RARAs after all of the data have been read, so either
+        # or both kinds of data may come from `gen`.
 
         previnp = None
-        gen = uvdat.setupAndRead (toread, 'a3', False,
-                                  nopass=True, nocal=True, nopol=True,
-                                  **uvdatoptions)
 
         for inp, preamble, data, flags in gen:
             if previnp is None or inp is not previnp:
@@ -314,12 +448,7 @@ class NoiseCal (object):
                                   inp.path ())
                 previnp = inp
 
-            # the 'a' uvdat options limits us to autocorrelations,
-            # but includes 1X-1Y-type autocorrelations
             bp = util.mir2bp (inp, preamble)
-            if not util.bpIsInten (bp):
-                continue
-            ap = bp[0]
             t = preamble[3]
 
             w = np.where (flags)[0]
@@ -327,18 +456,39 @@ class NoiseCal (object):
                 continue
 
             data = data[w]
-            rara = np.sqrt ((data.real**2).mean ())
 
-            seenaps.add (ap)
-            ag = rarawork.get (ap)
-            if ag is None:
-                ag = rarawork[ap] = ArrayGrower (3)
+            if util.apAnt (bp[0]) == util.apAnt (bp[1]):
+                # Autocorrelation. This includes 1X-1Y-type
+                # autocorrelations, which we don't use.
+                if rarawork is None or not util.bpIsInten (bp):
+                    continue
+
+                ap = bp[0]
+                rara = np.sqrt ((data.real**2).mean ())
+
+                ag = rarawork.get (ap)
+                if ag is None:
+                    ag = rarawork[ap] = ArrayGrower (3)
 
-            # We record w.size as a weight for the RARA measurement,
-            # but it's essentially noise-free.
-            ag.add (t, rara, w.size)
+                # We record w.size as a weight for the RARA measurement,
+                # but it's essentially noise-free.
+                ag.add (t, rara, w.size)
+            elif bpwork is not None:
+                rvar = data.real.var (ddof=1)
+                ivar = data.imag.var (ddof=1)
+                var = 0.5 * (rvar + ivar)
+                # The weight of the computed variance (i.e., the
+                # inverse square of the maximum-likelihood variance
+                # in the variance measurement) is 0.5 * (nsamp - ndof) / var**2.
+                # We have 2*w.size samples and 2 degrees of freedom, so:
+                wtvar = (w.size - 1) / var**2
 
-        self.saps = sorted (seenaps)
+                bpwork.add (bp[0], bp[1])
+                bpstats.add (t, var, wtvar)
+
+
+    def _compute_getraras (self, rarawork):
+        self.saps = sorted (rarawork.iterkeys ())
         raras = self.raras = {}
         apidxs = dict ((t[1], t[0]) for t in enumerate (self.saps))
 
@@ -349,73 +499,52 @@ class NoiseCal (object):
             raras[apidx] = raradata[:,sidx]
 
 
-    def _compute_getbpvs (self, toread, uvdatoptions):
-        raras = self.raras
-        apidxs = dict ((t[1], t[0]) for t in enumerate (self.saps))
-
-        sqbps = ArrayGrower (2, dtype=np.int)
-        bpdata = ArrayGrower (5)
+    def _compute_getbpvs (self, bpaps, bpstats):
+        # Join the cross-correlation statistics to the RARAs of their
+        # antpols. For each sample and each of its antpols we use the
+        # first RARA measurement at or after the sample time, and reject
+        # the sample if that is more than TTOL away.
 
-        nnorara = 0
-        seenidxs = set ()
-        gen = uvdat.setupAndRead (toread, 'x3', False,
-                                  nopass=False, nocal=False, nopol=False,
-                                  **uvdatoptions)
+        raras = self.raras
+        saps = np.asarray (self.saps, dtype=np.int)
+        nap = saps.size
+        nrec = bpstats.shape[0]
+        t = bpstats[:,0]
 
-        for inp, preamble, data, flags in gen:
-            bp = util.mir2bp (inp, preamble)
-            t = preamble[3]
+        idxs = np.minimum (np.searchsorted (saps, bpaps), nap - 1)
+        good = (saps[idxs] == bpaps).all (axis=1)
+        raraprops = np.zeros ((nrec, 2, 2)) # [rec, ap1/ap2, rara/rwt]
 
-            w = np.where (flags)[0]
-            if not w.size:
-                continue
+        for apidx in xrange (nap):
+            rdata = raras[apidx]
 
-            idx1, idx2 = apidxs.get (bp[0]), apidxs.get (bp[1])
-            if idx1 is None or idx2 is None:
-                nnorara += 1
-                continue
+            for col in xrange (2):
+                w = np.where (good & (idxs[:,col] == apidx))[0]
+                if not w.size:
+                    continue
 
-            rdata1, rdata2 = raras[idx1], raras[idx2]
+                tidx = rdata[0].searchsorted (t[w])
+                ok = tidx < rdata.shape[1]
+                tidx = np.where (ok, tidx, 0)
+                ok &= np.abs (rdata[0,tidx] - t[w]) <= TTOL
 
-            tidx1 = rdata1[0].searchsorted (t)
-            tidx2 = rdata2[0].searchsorted (t)
+                good[w[~ok]] = False
+                raraprops[w,col,0] = rdata[1,tidx]
+                raraprops[w,col,1] = rdata[2,tidx]
 
-            if (tidx1 < 0 or tidx1 >= rdata1.shape[1] or
-                tidx2 < 0 or tidx2 >= rdata2.shape[1]):
-                nnorara += 1
-                continue
+        nnorara = nrec - good.sum ()
+        w = np.where (good)[0]
+        sqbps = self.sqbps = idxs[w]
+        rara1, rwt1 = raraprops[w,0].T
+        rara2, rwt2 = raraprops[w,1].T
 
-            tr1, rara1, rwt1 = rdata1[:,tidx1]
-            tr2, rara2, rwt2 = rdata2[:,tidx2]
-            dt1 = np.abs (tr1 - t)
-            dt2 = np.abs (tr2 - t)
+        # We propagate the weight for crara but once again,
+        # it's basically noiseless.
+        crara = rara1 * rara2
+        cwt = 1. / (rara2**2 / rwt1 + rara1**2 / rwt2)
 
-            if max (dt1, dt2) > TTOL:
-                nnorara += 1
-                continue
-
-            # We propagate the weight for crara but once again,
-            # it's basically noiseless.
-            crara = rara1 * rara2
-            cwt = 1. / (rara2**2 / rwt1 + rara1**2 / rwt2)
-
-            data = data[w]
-            rvar = data.real.var (ddof=1)
-            ivar = data.imag.var (ddof=1)
-            var = 0.5 * (rvar + ivar)
-            # The weight of the computed variance (i.e., the
-            # inverse square of the maximum-likelihood variance
-            # in the variance measurement) is 0.5 * (nsamp - ndof) / var**2.
-            # We have 2*w.size samples and 2 degrees of freedom, so:
-            wtvar = (w.size - 1) / var**2
-
-            seenidxs.add (idx1)
-            seenidxs.add (idx2)
-            sqbps.add (idx1, idx2)
-            bpdata.add (t, var, wtvar, crara, cwt)
-
-        sqbps = self.sqbps = sqbps.finish ()
-        self.bpdata = bpdata.finish ()
+        self.bpdata = np.column_stack ((t[w], bpstats[w,1], bpstats[w,2],
+                                        crara, cwt))
         nsamp = sqbps.shape[0]
 
         if nnorara > nsamp * 0.02:
@@ -423,7 +552,10 @@ class NoiseCal (object):
                                  '(%.0f%%) of samples' % (nnorara, nsamp,
                                                           100. * nnorara / nsamp))
 
-        if len (seenidxs) == len (apidxs):
+        seen = np.zeros (nap, dtype=np.bool)
+        seen[sqbps.ravel ()] = True
+
+        if seen.all ():
             return
 
         # There exist antpols that we got autocorrelations for but
@@ -433,62 +565,64 @@ class NoiseCal (object):
         # them. To avoid a bunch of baggage in the analysis code, we
         # rewrite our data structures, which actually isn't so bad.
 
-        mapping = {}
-        newsaps = []
-        newraras = {}
+        seenidxs = np.where (seen)[0]
+        mapping = np.empty (nap, dtype=np.int)
+        mapping[seenidxs] = np.arange (seenidxs.size)
 
-        for idx in xrange (len (apidxs)):
-            if idx in seenidxs:
-                mapping[idx] = len (mapping)
-                newsaps.append (self.saps[idx])
-                newraras[mapping[idx]] = raras[idx]
-
-        self.saps = newsaps
-        self.raras = newraras
-
-        for i in xrange (nsamp):
-            sqbps[i,0] = mapping[sqbps[i,0]]
-            sqbps[i,1] = mapping[sqbps[i,1]]
+        self.saps = [self.saps[idx] for idx in seenidxs]
+        self.raras = dict ((mapping[idx], raras[idx]) for idx in seenidxs)
+        self.sqbps = mapping[sqbps]
 
 
     def _compute_solve (self):
         nap = len (self.saps)
-        sqbps = self.sqbps
+        idx1, idx2 = self.sqbps.T
         bpdata = self.bpdata
         nsamp = bpdata.shape[0]
+        var, wtvar, crara = bpdata[:,1:4].T
 
         # Get approximate solution by using a linear least squares
-        # solver on the log of our equation.
-
-        coeffs = np.zeros ((nap, nsamp))
-        values = np.empty (nsamp)
-        invsigmas = np.empty (nsamp)
-
-        for i in xrange (nsamp):
-            idx1, idx2 = sqbps[i]
-            var, wtvar, crara = bpdata[i,1:4]
-
-            coeffs[idx1,i] = coeffs[idx2,i] = 1
-            values[i] = np.log (var / crara)
-            # Here we ignore the noise in crara.
-            invsigmas[i] = crara * np.sqrt (wtvar)
-
-        soln = util.linLeastSquares (coeffs, values)
-
-        # Now refine and get uncertainties with a nonlinear solver.
+        # solver on the log of our equation. Each sample involves
+        # exactly two antpols, so we can build the normal equations
+        # directly from the index arrays rather than populating a
+        # dense (nap, nsamp) design matrix.
+
+        values = np.log (var / crara)
+        # Here we ignore the noise in crara.
+        invsigmas = crara * np.sqrt (wtvar)
+
+        normal = np.zeros ((nap, nap))
+        np.add.at (normal, (idx1, idx2), 1)
+        normal += normal.T
+        normal[np.diag_indices (nap)] = (np.bincount (idx1, minlength=nap) +
+                                         np.bincount (idx2, minlength=nap))
+        rhs = (np.bincount (idx1, weights=values, minlength=nap) +
+               np.bincount (idx2, weights=values, minlength=nap))
+        soln = np.linalg.solve (normal, rhs)
+
+        # Now refine and get uncertainties with a nonlinear solver. We
+        # provide the analytic Jacobian of params[idx1] * params[idx2].
+        # Only two elements of each of its columns are nonzero, and
+        # they're always in the same places, so we allocate it once
+        # and only ever overwrite those elements.
 
         soln = np.exp (soln)
         values = np.exp (values)
-        modelvals = np.empty (nsamp)
+        samps = np.arange (nsamp)
+        jac = np.zeros ((nap, nsamp))
 
         def nonlin (params):
-            for i in xrange (nsamp):
-                idx1, idx2 = sqbps[i]
-                modelvals[i] = params[idx1] * params[idx2]
-            return (values - modelvals) * invsigmas
+            return (values - params[idx1] * params[idx2]) * invsigmas
+
+        def nonlinjac (params):
+            jac[idx1,samps] = -invsigmas * params[idx2]
+            jac[idx2,samps] = -invsigmas * params[idx1]
+            return jac
 
         from scipy.optimize import leastsq
-        soln, cov, misc, mesg, flag = leastsq (nonlin, soln, full_output=True)
+        soln, cov, misc, mesg, flag = leastsq (nonlin, soln, Dfun=nonlinjac,
+                                               col_deriv=True, full_output=True)
+
         if flag < 1 or flag > 4 or cov is None:
             if cov is None:
                 expln = 'encountered singular matrix'
@@ -503,6 +637,7 @@ class NoiseCal (object):
             else:
                 util.die ('nonlinear fit failed: %s; mesg: %s', expln, mesg)
 
+        modelvals = soln[idx1] * soln[idx2]
         rchisq = (((values - modelvals) * invsigmas)**2).sum () / (nsamp - nap)
         print 'reduced chi squared: %.3f for %d DOF' % (rchisq, nsamp - nap)
 
@@ -510,12 +645,8 @@ class NoiseCal (object):
             cov = suncerts = np.empty (0)
         else:
             cov *= rchisq # copying scipy.optimize.curve_fit
-            suncerts = np.empty (nsamp)
-
-            for i in xrange (nsamp):
-                idx1, idx2 = sqbps[i]
-                suncerts[i] = np.sqrt ((soln[idx1]**2 * cov[idx2,idx2] +
-                                        soln[idx2]**2 * cov[idx1,idx1]))
+            d = np.diag (cov)
+            suncerts = np.sqrt (soln[idx1]**2 * d[idx2] + soln[idx2]**2 * d[idx1])
 
         self.solution = soln
         self.covar = cov
@@ -677,16 +808,20 @@ else:
 def tui_compute (args):
     toread = []
     uvdatoptions = {}
+    singlepass = False
 
     for arg in args:
-        if '=' in arg:
+        if arg == '--singlepass':
+            singlepass = True
+        elif '=' in arg:
             key, value = arg.split ('=', 1)
             uvdatoptions[key] = value
         else:
             toread.append (arg)
 
     if len (toread) < 2:
-        util.die ('usage: <vis1> [... visn] [uvdat options] <output name>')
+        util.die ('usage: [--singlepass] <vis1> [... visn] [uvdat options] '
+                  '<output name>')
 
     outpath = toread[-1]
     toread = [VisData (x) for x in toread[:-1]]
@@ -699,7 +834,7 @@ def tui_compute (args):
                   outpath, e)
 
     nc = NoiseCal ()
-    nc.compute (toread, **uvdatoptions)
+    nc.compute (toread, singlepass=singlepass, **uvdatoptions)
     nc.save (outpath)
     return 0
 
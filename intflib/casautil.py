@@ -5,7 +5,7 @@
 """
 
 __all__ = ('INVERSE_C_MS INVERSE_C_MNS pol_names pol_to_miriad msselect_keys '
-           'datadir logger forkandlog tools').split ()
+           'datadir logger forkandlog tools UTCToTT').split ()
 
 
 # Some constants that can be useful
@@ -156,6 +156,54 @@ def forkandlog (function, filter='INFO5', debug=False):
         raise e
 
 
+# Bulk time-scale conversion.
+#
+# Going through the measures tool for every visibility record is very
+# slow. But TT - UTC = 32.184 s + TAI - UTC, and since 1972 TAI - UTC
+# only changes by whole leap seconds at the end of a UTC day, so one
+# lookup per UTC day is enough to convert arbitrary arrays of times.
+
+_MJD_1972 = 41317 # TAI - UTC was not an integer before this date
+
+class UTCToTT (object):
+    """Convert MeasurementSet UTC timestamps (seconds since MJD 0, as in
+    the TIME column) to TT MJDs, consulting the measures tool once per
+    UTC day rather than once per timestamp. Pre-1972 times, when TAI -
+    UTC drifted continuously, are converted one unique value at a
+    time."""
+
+    def __init__ (self, me=None):
+        if me is None:
+            me = tools.measures ()
+        self.me = me
+        self._offsets = {} # UTC MJD (int) -> TT - UTC in days
+
+    def _measure (self, mjdutc):
+        mq = self.me.epoch ('utc', {'value': mjdutc, 'unit': 'd'})
+        return self.me.measure (mq, 'tt')['m0']['value']
+
+    def offset (self, day):
+        off = self._offsets.get (day)
+        if off is None:
+            off = self._offsets[day] = self._measure (day + 0.5) - (day + 0.5)
+        return off
+
+    def __call__ (self, times):
+        import numpy as np
+
+        mjdutc = np.asarray (times, dtype=np.double) / 86400.
+        days = np.floor (mjdutc).astype (np.int)
+        udays, inv = np.unique (days, return_inverse=True)
+        mjdtt = mjdutc + np.asarray ([self.offset (d) for d in udays])[inv]
+
+        early = (days < _MJD_1972)
+        if early.any ():
+            uearly, einv = np.unique (mjdutc[early], return_inverse=True)
+            mjdtt[early] = np.asarray ([self._measure (t) for t in uearly])[einv]
+
+        return mjdtt
+
+
 # Tool factories.
 
 class _Tools (object):
@@ -314,123 +314,192 @@ class WeightAccumulator (object):
         return sqrt (self.var ())
 ## end
 
-p2p = lambda ap1, ap2: util.bpToPBP32 ((ap1, ap2))
-
-
 def _format (aps):
     if isinstance (aps, int): aps = (aps, )
     return '-'.join (util.fmtAP (x) for x in aps)
 
 
-def _flagAnd (flags1, flags2, *rest):
-    # Avoid allocation of many temporary arrays here.
-    isect = np.logical_and (flags1, flags2)
+class IntegStore (object):
+    """Array-backed storage of the visibilities of a single integration.
 
-    for f in rest:
-        np.logical_and (isect, f, isect)
+    Records are added one baseline at a time with add(); `index` maps each
+    baseline key to its row in the arrays built by finish():
 
-    return isect
+      data    - (nbl, nchan) complex visibilities
+      flags   - (nbl, nchan) bool, True for good channels
+      var     - (nbl, ) variances
+      inttime - (nbl, ) integration times
+      sums    - (nbl, ) complex; sum of the good channels of each baseline
+      counts  - (nbl, ) int; number of good channels of each baseline
+      uniform - True if every baseline has the same flags
 
+    Adding a record for a baseline that's already present replaces it."""
 
-def _flushOneInteg3 (integData, accData, ap1, ap2, ap3):
-    tup12 = integData.get (p2p (ap1, ap2))
-    tup13 = integData.get (p2p (ap1, ap3))
-    tup23 = integData.get (p2p (ap2, ap3))
+    def __init__ (self):
+        self.clear ()
 
-    if tup12 is None or tup13 is None or tup23 is None:
-        return
+    def clear (self):
+        self.index = {}
+        self._rows = []
+        self.data = self.flags = self.var = self.inttime = None
+        self.sums = self.counts = self.uniform = None
+        return self
 
-    (d12, f12, v12, t12) =  tup12
-    (d13, f13, v13, t13) =  tup13
-    (d23, f23, v23, t23) =  tup23
+    def __len__ (self):
+        return len (self._rows)
 
-    assert t12 == t13 and t12 == t23
+    def add (self, key, data, flags, var, inttime):
+        idx = self.index.get (key)
+        rec = (data, flags, var, inttime)
 
-    w = np.where (_flagAnd (f12, f13, f23))
-    n = len (w[0])
+        if idx is None:
+            self.index[key] = len (self._rows)
+            self._rows.append (rec)
+        else:
+            self._rows[idx] = rec
+        return self
 
-    if n == 0: return
+    def finish (self):
+        nbl = len (self._rows)
+        nchan = self._rows[0][0].size if nbl else 0
+
+        self.data = np.empty ((nbl, nchan), dtype=np.complex)
+        self.flags = np.empty ((nbl, nchan), dtype=np.bool)
+        self.var = np.empty (nbl)
+        self.inttime = np.empty (nbl)
+
+        for i, (data, flags, var, inttime) in enumerate (self._rows):
+            if data.size != nchan:
+                raise ValueError ('all baselines in an integration must '
+                                  'have the same number of channels')
+            self.data[i] = data
+            self.flags[i] = flags
+            self.var[i] = var
+            self.inttime[i] = inttime
+
+        self.counts = self.flags.sum (axis=1)
+        self.sums = np.where (self.flags, self.data, 0).sum (axis=1)
+        self.uniform = bool ((self.flags == self.flags[:1]).all ())
+        return self
 
-    t = n * t12
-    c = (d12[w].sum () * d23[w].sum () * d13[w].sum ().conj ()) * t
-    v = (v12 + v13 + v23) * n**3 * t
 
-    accKey = (ap1, ap2, ap3)
-    if accKey not in accData:
-        accData[accKey] = (t, c, v)
+_combocache = {}
+
+def _combos (n, k):
+    """All k-element combinations of range (n), as a sorted (ncombo, k) int
+    array. Cached since the same antenna sets recur in every integration."""
+
+    key = (n, k)
+    c = _combocache.get (key)
+    if c is None:
+        from itertools import combinations
+        c = np.array (list (combinations (xrange (n), k)), dtype=np.int)
+        c.shape = (-1, k)
+        _combocache[key] = c
+    return c
+
+
+def _closureTerms (store, aps, k, pairs, nonzero=(), chunksize=2048):
+    """Gather the visibility sums needed to compute closure quantities over
+    every k-element combination of the sorted antpols `aps`. `pairs` lists
+    the index pairs within each combination that form the needed baselines,
+    e.g. ((0, 1), (0, 2), (1, 2)) for triples. A combination is used only if
+    all of its baselines are present in `store`.
+
+    As in closure.for, the sums for each combination are taken only over the
+    channels that are good in all of its baselines; channels where the
+    visibility is zero on any of the baselines indexed by `nonzero` are also
+    skipped. If the flags are the same on every baseline (the common case),
+    the per-baseline sums are used directly.
+
+    Returns (keys, rows, n, sums): keys is (ncombo, k) antpols, rows is
+    (ncombo, npair) store rows, n is (ncombo, ) number of channels used,
+    sums is (ncombo, npair) complex. Combinations with n = 0 are dropped."""
+
+    naps = len (aps)
+    npair = len (pairs)
+    empty = (np.empty ((0, k), dtype=np.int), np.empty ((0, npair), dtype=np.int),
+             np.empty (0, dtype=np.int), np.empty ((0, npair), dtype=np.complex))
+
+    if naps < k or not len (store):
+        return empty
+
+    pos = dict ((ap, i) for i, ap in enumerate (aps))
+    table = np.empty ((naps, naps), dtype=np.int)
+    table.fill (-1)
+
+    for bl, row in store.index.iteritems ():
+        a1, a2 = util.pbp32ToBP (bl)
+        if a1 in pos and a2 in pos:
+            table[pos[a1], pos[a2]] = row
+
+    combos = _combos (naps, k)
+    rows = np.empty ((combos.shape[0], npair), dtype=np.int)
+    for i, (p1, p2) in enumerate (pairs):
+        rows[:,i] = table[combos[:,p1], combos[:,p2]]
+
+    ok = (rows >= 0).all (axis=1)
+    combos = combos[ok]
+    rows = rows[ok]
+    ncombo = rows.shape[0]
+
+    if ncombo == 0:
+        return empty
+
+    fastpath = store.uniform
+    if fastpath and len (nonzero):
+        wf = store.flags[0]
+        fastpath = (store.data[:,wf] != 0).all ()
+
+    if fastpath:
+        n = np.empty (ncombo, dtype=np.int)
+        n.fill (store.counts[0])
+        sums = store.sums[rows]
     else:
-        (t0, c0, v0) = accData[accKey]
-        accData[accKey] = (t + t0, c + c0, v + v0)
-
-
-def _flushOneInteg4 (integData, accData, ap1, ap2, ap3, ap4):
-    tup12 = integData.get (p2p (ap1, ap2))
-    tup13 = integData.get (p2p (ap1, ap3))
-    tup24 = integData.get (p2p (ap2, ap4))
-    tup34 = integData.get (p2p (ap3, ap4))
+        n = np.empty (ncombo, dtype=np.int)
+        sums = np.empty ((ncombo, npair), dtype=np.complex)
 
-    if tup12 is None or tup13 is None or tup24 is None or tup34 is None:
-        return
+        for start in xrange (0, ncombo, chunksize):
+            r = rows[start:start+chunksize]
+            mask = store.flags[r[:,0]].copy ()
 
-    (d12, f12, v12, t12) =  tup12
-    (d13, f13, v13, t13) =  tup13
-    (d24, f24, v24, t24) =  tup24
-    (d34, f34, v34, t34) =  tup34
+            for i in xrange (1, npair):
+                mask &= store.flags[r[:,i]]
+            for i in nonzero:
+                mask &= (store.data[r[:,i]] != 0)
 
-    assert t12 == t13 and t12 == t24 and t12 == t34
+            n[start:start+chunksize] = mask.sum (axis=1)
 
-    # Avoid div-by-zero
-    w = np.where (_flagAnd (f12, f13, f24, f34, d13 != 0, d24 != 0))
-    n = len (w[0])
+            for i in xrange (npair):
+                sums[start:start+chunksize,i] = \
+                    np.where (mask, store.data[r[:,i]], 0).sum (axis=1)
 
-    if n == 0: return
+    keys = np.asarray (aps, dtype=np.int)[combos]
+    ok = (n > 0)
+    return keys[ok], rows[ok], n[ok], sums[ok]
 
-    t = n * t12
-    c = (d12[w].sum () * d34[w].sum () / d13[w].sum () / d24[w].sum ().conj ()) * t
 
-    # FIXME: in closure.for, the variance is the sum of the variances
-    # over flux**2, where flux = (|d12| + |d34| + |d14| + |d23|) / 4,
-    # but need to think through whether this is by channel or what.
-
-    v = (v12 + v13 + v24 + v34) * t
-
-    accKey = (ap1, ap2, ap3, ap4)
-    if accKey not in accData:
-        accData[accKey] = (t, c, v)
-    else:
-        (t0, c0, v0) = accData[accKey]
-        accData[accKey] = (t + t0, c + c0, v + v0)
+def _groupAccum (chunks):
+    """Combine lists of (keys, t, c, v) arrays accumulated over an averaging
+    interval into per-combination totals. Sums are accumulated in the order
+    the values were added."""
 
+    keys = np.concatenate ([ch[0] for ch in chunks])
+    t = np.concatenate ([ch[1] for ch in chunks])
+    c = np.concatenate ([ch[2] for ch in chunks])
+    v = np.concatenate ([ch[3] for ch in chunks])
 
-def _flushOneAcc3 (accData, allData, ap1, ap2, ap3):
-    key = (ap1, ap2, ap3)
-    tup = accData.get (key)
-    if tup is None:
-        return
+    dims = (keys.max () + 1, ) * keys.shape[1]
+    codes = np.ravel_multi_index (keys.T, dims)
+    ucodes, first, inv = np.unique (codes, return_index=True,
+                                    return_inverse=True)
+    nu = ucodes.size
 
-    (time, c, v) = tup
-
-    # note! not dividing by time since that doesn't affect phase.
-    # Does affect amp though.
-    ph = 180/np.pi * np.arctan2 (c.imag, c.real)
-    amp = np.abs (c) / time
-    thy = 180/np.pi * np.sqrt (v / time) / (amp ** (1./3))
-
-    allData.accum (key, (ph, thy))
-    #allData.accum (key, (time, ph, v / time))
-
-
-def _flushOneAcc4 (accData, allData, ap1, ap2, ap3, ap4):
-    key = (ap1, ap2, ap3, ap4)
-    tup = accData.get (key)
-    if tup is None:
-        return
-
-    (time, c, v) = tup
-    amp = np.abs (c) / time
-    thy = np.sqrt (v) / time
-
-    allData.accum (key, (amp, thy))
+    tsum = np.bincount (inv, weights=t, minlength=nu)
+    csum = (np.bincount (inv, weights=c.real, minlength=nu) +
+            1j * np.bincount (inv, weights=c.imag, minlength=nu))
+    vsum = np.bincount (inv, weights=v, minlength=nu)
+    return keys[first], tsum, csum, vsum
 
 
 class ClosureComputer (object):
@@ -438,8 +507,8 @@ class ClosureComputer (object):
         self.rmshist = rmshist
         self.relative = relative
 
-        self.integData = {}
-        self.accData = {}
+        self.integData = IntegStore ()
+        self.accData = []
         self.allData = AccDict (lambda: ArrayGrower (2), lambda o, v: o.addLine (v))
         self.seenaps = {}
         self.seenpols = set ()
@@ -454,7 +523,43 @@ class ClosureComputer (object):
             else:
                 self.seenaps[fpol] = set ((ap, ))
 
-        self.integData[pbp] = (data, flags, var, inttime)
+        self.integData.add (pbp, data, flags, var, inttime)
+
+
+    def flushInteg (self):
+        st = self.integData
+
+        if len (st):
+            st.finish ()
+
+            for pol in self.seenpols:
+                aps = sorted (self.seenaps[pol])
+                keys, rows, n, sums = _closureTerms (st, aps, self.nap,
+                                                     self.pairs, self.nonzero)
+                if not n.size:
+                    continue
+
+                tints = st.inttime[rows]
+                assert (tints == tints[:,:1]).all ()
+                t = n * tints[:,0]
+                c, v = self._integTerms (n, t, sums, st.var[rows])
+                self.accData.append ((keys, t, c, v))
+
+        st.clear ()
+
+
+    def flushAcc (self):
+        if len (self.accData):
+            keys, time, c, v = _groupAccum (self.accData)
+            vals = self._accTerms (time, c, v)
+            all = self.allData
+
+            for i, key in enumerate (keys.tolist ()):
+                all.accum (tuple (key), vals[i])
+
+        self.accData = []
+        self.seenpols = set ()
+        self.seenaps = {}
 
 
     def pDataSummary (self):
@@ -541,44 +646,24 @@ class TripleComputer (ClosureComputer):
     ndatum ='nTrip'
     onestat = 'RMS'
     manystat = 'Mean(RMS)'
+    nap = 3
+    pairs = ((0, 1), (0, 2), (1, 2))
+    nonzero = ()
 
 
-    def flushInteg (self):
-        id, ac = self.integData, self.accData
-
-        for pol in self.seenpols:
-            aps = sorted (self.seenaps[pol])
-
-            for i in xrange (0, len (aps)):
-                ap3 = aps[i]
-                for j in xrange (0, i):
-                    ap2 = aps[j]
-                    for k in xrange (0, j):
-                        ap1 = aps[k]
-
-                        _flushOneInteg3 (id, ac, ap1, ap2, ap3)
-
-        self.integData = {}
-
-
-    def flushAcc (self):
-        acc, all = self.accData, self.allData
-
-        for pol in self.seenpols:
-            aps = sorted (self.seenaps[pol])
+    def _integTerms (self, n, t, sums, var):
+        c = (sums[:,0] * sums[:,2] * sums[:,1].conj ()) * t
+        v = (var[:,0] + var[:,1] + var[:,2]) * n**3 * t
+        return c, v
 
-            for i in xrange (0, len (aps)):
-                ap3 = aps[i]
-                for j in xrange (0, i):
-                    ap2 = aps[j]
-                    for k in xrange (0, j):
-                        ap1 = aps[k]
 
-                        _flushOneAcc3 (acc, all, ap1, ap2, ap3)
-
-        self.accData = {}
-        self.seenpols = set ()
-        self.seenaps = {}
+    def _accTerms (self, time, c, v):
+        # note! not dividing by time since that doesn't affect phase.
+        # Does affect amp though.
+        ph = 180/np.pi * np.arctan2 (c.imag, c.real)
+        amp = np.abs (c) / time
+        thy = 180/np.pi * np.sqrt (v / time) / (amp ** (1./3))
+        return np.column_stack ((ph, thy))
 
 
     def process (self):
@@ -645,47 +730,26 @@ class QuadComputer (ClosureComputer):
     ndatum = 'nQuad'
     onestat = 'log(RMS)'
     manystat = 'RMS(log(RMS))'
+    nap = 4
+    pairs = ((0, 1), (0, 2), (1, 3), (2, 3))
+    nonzero = (1, 2) # avoid div-by-zero
 
-    def flushInteg (self):
-        id, ac = self.integData, self.accData
-
-        for pol in self.seenpols:
-            aps = sorted (self.seenaps[pol])
 
-            for i in xrange (0, len (aps)):
-                ap4 = aps[i]
-                for j in xrange (0, i):
-                    ap3 = aps[j]
-                    for k in xrange (0, j):
-                        ap2 = aps[k]
-                        for l in xrange (0, k):
-                            ap1 = aps[l]
+    def _integTerms (self, n, t, sums, var):
+        c = (sums[:,0] * sums[:,3] / sums[:,1] / sums[:,2].conj ()) * t
 
-                            _flushOneInteg4 (id, ac, ap1, ap2, ap3, ap4)
+        # FIXME: in closure.for, the variance is the sum of the variances
+        # over flux**2, where flux = (|d12| + |d34| + |d14| + |d23|) / 4,
+        # but need to think through whether this is by channel or what.
 
-        self.integData = {}
+        v = (var[:,0] + var[:,1] + var[:,2] + var[:,3]) * t
+        return c, v
 
 
-    def flushAcc (self):
-        acc, all = self.accData, self.allData
-
-        for pol in self.seenpols:
-            aps = sorted (self.seenaps[pol])
-
-            for i in xrange (0, len (aps)):
-                ap4 = aps[i]
-                for j in xrange (0, i):
-                    ap3 = aps[j]
-                    for k in xrange (0, j):
-                        ap2 = aps[k]
-                        for l in xrange (0, k):
-                            ap1 = aps[l]
-
-                            _flushOneAcc4 (acc, all, ap1, ap2, ap3, ap4)
-
-        self.accData = {}
-        self.seenpols = set ()
-        self.seenaps = {}
+    def _accTerms (self, time, c, v):
+        amp = np.abs (c) / time
+        thy = np.sqrt (v) / time
+        return np.column_stack ((amp, thy))
 
 
     def process (self):
@@ -0,0 +1,523 @@
+# Copyright 2012-2013 Peter Williams
+# Licensed under the GNU General Public License version 3 or higher
+
+"""msextract - extract point-source fluxes from MeasurementSet visibilities
+
+This is the shared engine behind msphotom (time series), msdynspec
+(dynamic spectrum) and msptspec (spectrum by spectral window). The
+function extract() makes a single pass over the selected data; each
+chunk of records is rephased once (see rephase.py) and then handed to
+any number of "products", which accumulate the weighted sums that they
+need.
+
+The fundamental assumption is that the only signal in the visibilities
+is from a point source at the phasing center, and that all sampled
+polarizations get equal contributions from it. All polarizations are
+averaged together.
+"""
+
+import os, numpy as np
+import casautil, rephase
+
+__all__ = 'Chunk DynamicSpectrum SpwSpectrum TimeBinStore TimeSeries extract'.split ()
+
+
+class Chunk (object):
+    """A chunk of visibility records as returned by ms.getdata(), rephased
+    if requested. Quantities needed by more than one product are computed
+    on first use and cached.
+
+    data   - (ncorr, nchan, nrow) complex visibilities
+    ok     - (ncorr, nchan, nrow) bool, True where unflagged
+    weight - (ncorr, nrow) weights
+    ddid, spwid - the data description and spectral window IDs
+    """
+
+    def __init__ (self, cols, datacol, ddid, spwid, tott, rephaser=None):
+        self.cols = cols
+        self.ddid = ddid
+        self.spwid = spwid
+        self._tott = tott
+        self._times = self._records = None
+
+        self.ok = ~cols['flag']
+        self.weight = cols['weight']
+        self.data = cols[datacol]
+
+        if rephaser is not None:
+            freqs = cols['axis_info']['freq_axis']['chan_freq']
+            # In our usage, freqs should be of shape (nchan, 1). If you
+            # don't selectinit() with a specific DD, you seem to get
+            # (nchan, nspw). Neither seems to really agree with the docs.
+            # Trying to be careful in case CASA changes.
+            assert freqs.shape[1] == 1, 'internal inconsistency, chan_freq??'
+            # convert to m^-1 so we can multiply against UVW directly:
+            freqs = freqs[:,0] * casautil.INVERSE_C_MS
+            # data are (ncorr, nchan, nrow); the phasor is (nrow, nchan).
+            rephaser.apply (self.data.swapaxes (1, 2), cols['uvw'], freqs, spwid)
+
+        # XXXXX casacore is currently broken and returns the raw
+        # weights from the dataset rather than applying the
+        # polarization selection. Fortunately all of our weights are
+        # the same, and you can never fetch more pol types than the
+        # dataset has, so everything below works despite the bug.
+
+    def times (self):
+        """Returns (tidx, mjdtts): the TT MJDs of the distinct timestamps
+        in the chunk, and the index into them of each record. Only the
+        distinct timestamps go through the time-scale conversion."""
+        if self._times is None:
+            utimes, tidx = np.unique (self.cols['time'], return_inverse=True)
+            self._times = tidx, self._tott (utimes)
+        return self._times
+
+    def records (self):
+        """Returns (i, d, wt) for every polarization/record combination with
+        at least one unflagged channel: the record index, the mean
+        unflagged visibility, and its weight, scaled down by the flagged
+        fraction of the channels."""
+        if self._records is None:
+            ncorr, nchan, nrow = self.ok.shape
+            ngood = self.ok.sum (axis=1) # (ncorr, nrow)
+            j, i = np.nonzero (ngood)
+            ngood = ngood[j,i]
+            d = np.where (self.ok, self.data, 0).sum (axis=1)[j,i] / ngood
+            # account for flagged parts. 90% sure this is the
+            # right thing to do:
+            wt = self.weight[j,i].astype (np.double) * ngood / nchan
+            self._records = i, d, wt
+        return self._records
+
+
+# The weighted sums accumulated for each time or spectral window bin.
+# n is the number of samples.
+
+WR, WI, WR2, WI2, WT, WT2, N = range (7)
+NSUMS = 7
+
+
+def _sums (keys, dr, di, wt, nbins):
+    """Returns (NSUMS, nbins) array binning the data in each of the sums."""
+    dr = dr.astype (np.double)
+    di = di.astype (np.double)
+    sums = np.empty ((NSUMS, nbins))
+
+    for k, v in enumerate ((wt * dr, wt * di, wt * dr**2, wt * di**2,
+                            wt, wt**2, None)):
+        sums[k] = np.bincount (keys, v, nbins)
+
+    return sums
+
+
+def _fluxstats (wr, wi, wr2, wi2, wt, wt2, datascale, believeweights):
+    r_sc = wr / wt * datascale
+    i_sc = wi / wt * datascale
+    r2_sc = wr2 / wt * datascale**2
+    i2_sc = wi2 / wt * datascale**2
+
+    if believeweights:
+        ru_sc = wt**-0.5 * datascale
+        iu_sc = wt**-0.5 * datascale
+    else:
+        rv_sc = r2_sc - r_sc**2 # variance among real/imag msmts
+        iv_sc = i2_sc - i_sc**2
+        ru_sc = np.sqrt (rv_sc * wt2) / wt # uncert in mean real/img values
+        iu_sc = np.sqrt (iv_sc * wt2) / wt
+
+    mag = np.sqrt (r_sc**2 + i_sc**2)
+    umag = np.sqrt (r_sc**2 * ru_sc**2 + i_sc**2 * iu_sc**2) / mag
+    return r_sc, ru_sc, i_sc, iu_sc, mag, umag
+
+
+class TimeBinStore (object):
+    """A growable store of accumulators for a sorted set of time bins.
+
+    The sums live in a single (ncol, capacity, nwidth) array, so that each
+    column is contiguous in time. The array doubles in size when full. If
+    spilldir is given, it is a memory-mapped .npy file created in that
+    directory, so that the OS can page it out for long tracks; the file
+    is deleted by close (). Otherwise it is held in memory.
+
+    times   - sorted (n,) array of the bin times
+    column (k) - (n, nwidth) view of the k'th sum
+    """
+
+    def __init__ (self, ncol, nwidth, spilldir=None, initsize=256):
+        self.ncol = ncol
+        self.nwidth = nwidth
+        self.spilldir = spilldir
+        self.n = 0
+        self._path = None
+        self._times = np.empty (initsize)
+        self._cols = self._alloc (initsize)
+
+    def _alloc (self, size):
+        shape = (self.ncol, size, self.nwidth)
+
+        if self.spilldir is None:
+            return np.zeros (shape)
+
+        import tempfile
+        fd, path = tempfile.mkstemp (suffix='.npy', prefix='timebins',
+                                     dir=self.spilldir)
+        os.close (fd)
+        cols = np.lib.format.open_memmap (path, mode='w+', dtype=np.double,
+                                          shape=shape)
+        self._unlink ()
+        self._path = path
+        return cols
+
+    def _unlink (self):
+        if self._path is not None:
+            os.unlink (self._path)
+            self._path = None
+
+    def close (self):
+        self._cols = None
+        self._unlink ()
+
+    @property
+    def times (self):
+        return self._times[:self.n]
+
+    def column (self, k):
+        return self._cols[k,:self.n]
+
+    def _reserve (self, n):
+        size = self._times.size
+        if n <= size:
+            return
+
+        while size < n:
+            size *= 2
+
+        times = np.empty (size)
+        times[:self.n] = self._times[:self.n]
+        old = self._cols
+        cols = self._alloc (size)
+
+        for k in xrange (self.ncol):
+            cols[k,:self.n] = old[k,:self.n]
+
+        self._times = times
+        self._cols = cols
+
+    def add (self, times, values):
+        """Add values of shape (ncol, ntime, nwidth) into the bins for times,
+        which must be sorted and unique, creating bins as needed."""
+        n = self.n
+        pos = np.searchsorted (self.times, times)
+        match = (pos < n)
+        match[match] = (self._times[pos[match]] == times[match])
+
+        if match.all ():
+            self._cols[:,pos] += values
+            return
+
+        if match.any ():
+            self._cols[:,pos[match]] += values[:,match]
+
+        new = ~match
+        pos = pos[new]
+        nnew = pos.size
+        self._reserve (n + nnew)
+
+        # New bins almost always go at the end. Otherwise, shift the
+        # tail of the store to make room. (pos + arange (nnew)) are the
+        # final indices of the new bins.
+
+        first = pos[0]
+        dest = pos + np.arange (nnew)
+
+        if first < n:
+            keep = np.ones (n - first + nnew, dtype=np.bool)
+            keep[dest - first] = False
+            tail = self._times[first:n].copy ()
+            self._times[first:n+nnew][keep] = tail
+
+            for k in xrange (self.ncol):
+                tail = self._cols[k,first:n].copy ()
+                self._cols[k,first:n+nnew][keep] = tail
+
+        self._times[dest] = times[new]
+        self._cols[:,dest] = values[:,new]
+        self.n = n + nnew
+
+
+class TimeSeries (object):
+    """Flux as a function of time, averaging over all channels and spectral
+    windows (msphotom)."""
+
+    needtime = True
+
+    def __init__ (self):
+        self.store = TimeBinStore (NSUMS, 1)
+
+    def setup (self, info):
+        pass
+
+    def accumulate (self, chunk):
+        tidx, mjdtts = chunk.times ()
+        i, d, wt = chunk.records ()
+        sums = _sums (tidx[i], d.real, d.imag, wt, mjdtts.size)
+        self.store.add (mjdtts, sums[:,:,np.newaxis])
+
+    def rows (self, datascale=1e6, believeweights=False):
+        """Generates (mjd, dtmin, re, ure, im, uim, abs, uabs, nsamp)."""
+        mjds = self.store.times
+        if not mjds.size:
+            return
+
+        cols = [self.store.column (k)[:,0] for k in xrange (NSUMS)]
+        w = np.where (cols[N] > 0)[0] # could be all flagged
+
+        dtmin = 1440 * (mjds[w] - mjds[0])
+        stats = _fluxstats (*([c[w] for c in cols[:N]] + [datascale, believeweights]))
+
+        for k in xrange (w.size):
+            yield ((mjds[w[k]], dtmin[k]) + tuple (s[k] for s in stats) +
+                   (int (cols[N][w[k]]), ))
+
+    def write (self, stream, datascale=1e6, believeweights=False, format='humane'):
+        """The "humane" format has fixed-width columns; the "pandas" format
+        is tab-separated with a header, for pandas.read_table ()."""
+        if format == 'pandas':
+            print >>stream, 'mjd dtmin re ure im uim abs uabs nsamp'.replace (' ', '\t')
+
+        for row in self.rows (datascale, believeweights):
+            if format == 'pandas':
+                print >>stream, '\t'.join (str (x) for x in row)
+            else:
+                print >>stream, \
+                    '%12.5f %6.2f %10.2f %10.2f %10.2f %10.2f %10.2f %10.2f %d' % row
+
+
+class SpwSpectrum (object):
+    """Flux in each spectral window, averaging over all times and
+    channels (msptspec)."""
+
+    needtime = False
+
+    def __init__ (self):
+        self.spwbins = {}
+
+    def setup (self, info):
+        self.spwmfreqs = np.asarray ([f.mean () for f in info.spwfreqs])
+
+    def accumulate (self, chunk):
+        i, d, wt = chunk.records ()
+        sums = _sums (np.zeros (i.size, dtype=np.int), d.real, d.imag, wt, 1)
+
+        sdata = self.spwbins.get (chunk.spwid)
+        if sdata is None: # might have multiple ddids going to one spw
+            sdata = self.spwbins[chunk.spwid] = np.zeros (NSUMS)
+        sdata += sums[:,0]
+
+    def rows (self, datascale=1e6, believeweights=False):
+        """Generates (mfreq, spw, re, ure, im, uim, abs, uabs, nsamp),
+        sorted by mean frequency in GHz."""
+        spws = sorted (self.spwbins.iterkeys (), key=lambda s: self.spwmfreqs[s])
+
+        for spw in spws:
+            sdata = self.spwbins[spw]
+            if sdata[N] == 0:
+                continue # could be all flagged
+
+            stats = _fluxstats (*(list (sdata[:N]) + [datascale, believeweights]))
+            yield (self.spwmfreqs[spw], spw) + stats + (int (sdata[N]), )
+
+    def write (self, stream, datascale=1e6, believeweights=False):
+        for row in self.rows (datascale, believeweights):
+            print >>stream, \
+                '%8.4f %2d %10.2f %10.2f %10.2f %10.2f %10.2f %10.2f %d' % row
+
+
+class DynamicSpectrum (object):
+    """Flux as a function of time and frequency, merging channels of the
+    same frequency across spectral windows (msdynspec). If spilldir is
+    given, the accumulators are kept in a memory-mapped scratch file in
+    that directory; see TimeBinStore."""
+
+    needtime = True
+
+    def __init__ (self, spilldir=None):
+        self.spilldir = spilldir
+
+    def setup (self, info):
+        allfreqs = set ()
+        for freqs in info.spwfreqs:
+            allfreqs.update (freqs)
+        self.allfreqs = np.asarray (sorted (allfreqs))
+        self.freqmaps = [np.searchsorted (self.allfreqs, freqs)
+                         for freqs in info.spwfreqs]
+        self.store = TimeBinStore (NSUMS, self.allfreqs.size, self.spilldir)
+
+    def accumulate (self, chunk):
+        nfreq = self.allfreqs.size
+        tidx, mjdtts = chunk.times ()
+        nbins = mjdtts.size * nfreq
+
+        j, c, i = np.nonzero (chunk.ok)
+        keys = tidx[i] * nfreq + self.freqmaps[chunk.spwid][c]
+        wt = chunk.weight[j,i].astype (np.double)
+        d = chunk.data[j,c,i]
+        sums = _sums (keys, d.real, d.imag, wt, nbins)
+        self.store.add (mjdtts, sums.reshape ((NSUMS, mjdtts.size, nfreq)))
+
+    def _plane (self, k, start, stop, believeweights):
+        """Compute rows [start:stop) of output plane k; see cube ()."""
+        s = [self.store.column (q)[start:stop] for q in xrange (NSUMS)]
+        n = s[N]
+        res = np.zeros (n.shape)
+        w = (n > 0) # could be all flagged
+        wt = s[WT][w]
+
+        if k == 4:
+            res[w] = n[w]
+        elif k in (0, 2):
+            res[w] = s[(WR, WI)[k // 2]][w] / wt
+        elif believeweights:
+            res[w] = wt**-0.5
+        else:
+            v = s[(WR, WI)[k // 2]][w] / wt
+            v2 = s[(WR2, WI2)[k // 2]][w] / wt
+            rv = v2 - v**2 # variance among real/imag msmts
+            res[w] = np.sqrt (rv * s[WT2][w]) / wt # uncert in mean real/img values
+
+        return res
+
+    def cube (self, believeweights=False):
+        """Returns (mjds, freqs, data), where freqs are in GHz and data has
+        shape (5, ntime, nfreq), the first axis being re, ure, im, uim,
+        nsamp."""
+        ntime = self.store.n
+        data = np.empty ((5, ntime, self.allfreqs.size))
+
+        for k in xrange (5):
+            data[k] = self._plane (k, 0, ntime, believeweights)
+
+        return self.store.times.copy (), self.allfreqs, data
+
+    def write (self, stream, believeweights=False):
+        """Writes the outputs of cube () as three consecutive np.save()s, but
+        computes and writes the data cube a block of times at a time
+        rather than materializing it. Closes the store afterwards."""
+        ntime = self.store.n
+        nfreq = self.allfreqs.size
+        np.save (stream, self.store.times)
+        np.save (stream, self.allfreqs)
+
+        hdr = {'descr': np.lib.format.dtype_to_descr (np.dtype (np.double)),
+               'fortran_order': False, 'shape': (5, ntime, nfreq)}
+        np.lib.format.write_array_header_1_0 (stream, hdr)
+        blocksize = max (1, 2**20 // max (nfreq, 1))
+
+        for k in xrange (5):
+            for start in xrange (0, ntime, blocksize):
+                stop = min (start + blocksize, ntime)
+                stream.write (self._plane (k, start, stop, believeweights).tostring ())
+
+        self.store.close ()
+
+
+class _Info (object):
+    pass
+
+
+def extract (cfg, *products):
+    """Make one pass over a MeasurementSet, feeding every chunk to each of
+    the products. cfg provides vis, datacol, polarization, rephase (None
+    or (RA, dec) in radians), and the MS selection keywords. Raises
+    RuntimeError if the selected data are unsuitable."""
+    tb = casautil.tools.table ()
+    ms = casautil.tools.ms ()
+    me = casautil.tools.measures ()
+
+    # Read stuff in. Even if the weight values don't have their
+    # absolute scale set correctly, we can still use them to set the
+    # relative weighting of the data points.
+    #
+    # datacol is (ncorr, nchan, nchunk)
+    # flag is (ncorr, nchan, nchunk)
+    # weight is (ncorr, nchunk)
+    # uvw is (3, nchunk)
+    # time is (nchunk)
+    # axis_info.corr_axis is (ncorr)
+    # axis_info.freq_axis.chan_freq is (nchan, 1) [for now?]
+
+    ms.open (cfg.vis)
+    sels = dict ((n, cfg.get (n)) for n in casautil.msselect_keys
+                 if cfg.get (n) is not None)
+    ms.msselect (sels)
+
+    rangeinfo = ms.range ('data_desc_id field_id'.split ())
+    ddids = rangeinfo['data_desc_id']
+    fields = rangeinfo['field_id']
+    colnames = [cfg.datacol] + 'flag weight axis_info'.split ()
+
+    if any (p.needtime for p in products):
+        colnames.append ('time')
+
+    if fields.size != 1:
+        # I feel comfortable making this a fatal error, even if we're
+        # not rephasing.
+        raise RuntimeError ('selected data should contain precisely one '
+                            'field; got %d' % fields.size)
+
+    info = _Info ()
+
+    tb.open (os.path.join (cfg.vis, 'DATA_DESCRIPTION'))
+    info.ddspws = tb.getcol ('SPECTRAL_WINDOW_ID')
+    tb.close ()
+
+    # FIXME: Chunk gets 'freqs' on the fly for rephasing, while the
+    # products use these; should honor that. But then mapping and data
+    # storage get super inefficient.
+
+    tb.open (os.path.join (cfg.vis, 'SPECTRAL_WINDOW'))
+    info.spwfreqs = [tb.getcell ('CHAN_FREQ', i) * 1e-9 # -> GHz
+                     for i in xrange (tb.nrows ())]
+    tb.close ()
+
+    rephaser = None
+
+    if cfg.rephase is not None:
+        fieldid = fields[0]
+        tb.open (os.path.join (cfg.vis, 'FIELD'))
+        phdirinfo = tb.getcell ('PHASE_DIR', fieldid)
+        tb.close ()
+
+        if phdirinfo.shape[1] != 1:
+            raise RuntimeError ('trying to rephase but target field (#%d) has a '
+                                'time-variable phase center, which I can\'t '
+                                'handle' % fieldid)
+        ra0, dec0 = phdirinfo[:,0] # in radians.
+        rephaser = rephase.Rephaser (rephase.lmn (ra0, dec0, cfg.rephase[0],
+                                                  cfg.rephase[1]))
+        colnames.append ('uvw')
+
+    for p in products:
+        p.setup (info)
+
+    tott = casautil.UTCToTT (me)
+
+    for ddid in ddids:
+        ms.selectinit (ddid)
+        if cfg.polarization is not None:
+            ms.selectpolarization (cfg.polarization.split (','))
+        ms.iterinit (maxrows=4096)
+        ms.iterorigin ()
+
+        spwid = info.ddspws[ddid]
+
+        while True:
+            chunk = Chunk (ms.getdata (items=colnames), cfg.datacol,
+                           ddid, spwid, tott, rephaser)
+
+            for p in products:
+                p.accumulate (chunk)
+
+            if not ms.iternext ():
+                break
+
+    ms.close ()
@@ -67,6 +67,7 @@ FIXME: compute weighted center times / time bounds via inttime, etc
 """
 
 import sys, numpy as np, miriad
+import rephase
 from mirtask import keys, uvdat, util, cliutil
 
 IDENT = '$Id$'
@@ -95,28 +96,92 @@ class Fluxer (object):
         return self
 
 
-    lmn = None
+    rephaser = None
     phscale = None
 
     def prepOffset (self, inp, nchan):
-        # Copied from mmm/hex/hex-lib-calcgainerr
-
         ra0 = inp.getVarDouble ('ra')
         dec0 = inp.getVarDouble ('dec')
         ra = ra0 + self.offset[0] / np.cos (dec0)
         dec = dec0 + self.offset[1]
-
-        l = np.sin (ra - ra0) * np.cos (dec)
-        m = np.sin (dec) * np.cos (dec0) - np.cos (ra - ra0) * np.cos (dec) * np.sin (dec0)
-        n = np.sin (dec) * np.sin (dec0) + np.cos (ra - ra0) * np.cos (dec) * np.cos (dec0)
-        n -= 1 # makes the work below easier
-        self.lmn = np.asarray ([l, m, n])
+        self.rephaser = rephase.Rephaser (rephase.lmn (ra0, dec0, ra, dec))
 
         # FIXME: assuming nspect=1, nwide=0
         sdf = inp.getVarDouble ('sdf')
         sfreq = inp.getVarDouble ('sfreq')
         self.phscale = 1 + np.arange (nchan) * sdf / sfreq
 
+
+    # Records are buffered up so that rephasing and accumulation can be
+    # done a block at a time.
+
+    bufsize = 1024
+    nbuf = 0
+    bufdata = None
+
+    def buffer (self, byPol, pol, variance, uvw, data, flags):
+        if self.bufdata is not None and data.size != self.bufdata.shape[1]:
+            self.accumulate (byPol)
+            self.bufdata = None
+
+        if self.bufdata is None:
+            self.bufdata = np.empty ((self.bufsize, data.size), dtype=data.dtype)
+            self.bufflags = np.empty ((self.bufsize, data.size), dtype=np.bool)
+            self.bufuvw = np.empty ((3, self.bufsize))
+            self.bufpol = np.empty (self.bufsize, dtype=np.int)
+            self.bufvar = np.empty (self.bufsize)
+
+        i = self.nbuf
+        self.bufdata[i] = data
+        self.bufflags[i] = flags
+        self.bufuvw[:,i] = uvw
+        self.bufpol[i] = pol
+        self.bufvar[i] = variance
+        self.nbuf += 1
+
+        if self.nbuf == self.bufsize:
+            self.accumulate (byPol)
+
+
+    def accumulate (self, byPol):
+        n = self.nbuf
+        if n == 0:
+            return
+        self.nbuf = 0
+
+        data = self.bufdata[:n]
+        flags = self.bufflags[:n]
+        variance = self.bufvar[:n]
+
+        if self.doOffset:
+            self.rephaser.apply (data, self.bufuvw[:,:n], self.phscale, 0)
+
+        dr = np.where (flags, data.real, 0).astype (np.double)
+        di = np.where (flags, data.imag, 0).astype (np.double)
+        ngood = flags.sum (axis=1)
+        wt = 1 / variance
+
+        pols, pidx = np.unique (self.bufpol[:n], return_inverse=True)
+        sums = np.empty ((5, pols.size))
+        sums[D_REAL] = np.bincount (pidx, dr.sum (axis=1) * wt)
+        sums[D_IMAG] = np.bincount (pidx, di.sum (axis=1) * wt)
+        sums[D_VAR] = np.bincount (pidx, variance * ngood)
+        sums[D_AMP2] = np.bincount (pidx, (dr**2 + di**2).sum (axis=1))
+        sums[D_TOTWT] = np.bincount (pidx, wt * ngood)
+        counts = np.bincount (pidx, ngood)
+
+        for k, pol in enumerate (pols):
+            if pol in byPol:
+                ddata, idata = byPol[pol]
+            else:
+                ddata = np.zeros (5, dtype=np.double)
+                idata = np.zeros (1, dtype=np.int)
+                byPol[pol] = ddata, idata
+
+            ddata += sums[:,k]
+            idata[I_COUNT] += int (counts[k])
+
+
     def process (self):
         byPol = {}
         tMin = tMax = None
@@ -125,8 +190,6 @@ class Fluxer (object):
             if not flags.any ():
                 continue
 
-            pol = inp.getPol ()
-            variance = inp.getVariance ()
             t = preamble[3]
 
             # Separation into intervals -- time to flush?
@@ -134,6 +197,7 @@ class Fluxer (object):
             if tMin is None:
                 tMin = tMax = t
             elif t - tMin > self.interval or tMax - t > self.interval:
+                self.accumulate (byPol)
                 self.flush (tMin, tMax, byPol)
                 byPol = {}
                 tMin = tMax = t
@@ -143,33 +207,14 @@ class Fluxer (object):
 
             # Accumulation
 
-            if self.doOffset:
-                if self.lmn is None:
-                    self.prepOffset (inp, data.size)
-                ph0 = (0-2j) * np.pi * np.dot (self.lmn, preamble[0:3])
-                data *= np.exp (ph0 * self.phscale)
-
-            if pol in byPol:
-                ddata, idata = byPol[pol]
-            else:
-                ddata = np.zeros (5, dtype=np.double)
-                idata = np.zeros (1, dtype=np.int)
-                byPol[pol] = ddata, idata
-
-            w = np.where (flags)[0]
-            ngood = w.size
-            data = data[w]
-
-            wt = 1 / variance
+            if self.doOffset and self.rephaser is None:
+                self.prepOffset (inp, data.size)
 
-            ddata[D_REAL] += data.real.sum () * wt
-            ddata[D_IMAG] += data.imag.sum () * wt
-            ddata[D_VAR] += variance * ngood
-            ddata[D_AMP2] += (data.real**2 + data.imag**2).sum ()
-            ddata[D_TOTWT] += wt * ngood
-            idata[I_COUNT] += ngood
+            self.buffer (byPol, inp.getPol (), inp.getVariance (),
+                         preamble[0:3], data, flags)
 
         if tMin is not None:
+            self.accumulate (byPol)
             self.flush (tMin, tMax, byPol)
             byPol = {}
 
@@ -0,0 +1,87 @@
+# Copyright 2013 Peter Williams
+# Licensed under the GNU General Public License version 3 or higher
+
+"""rephase - shift the phase center of chunks of visibility data
+
+Used by pwflux and the MeasurementSet extraction tools (msextract and
+friends). Rather than computing exp(-2 pi i (lmn . uvw) nu) record by
+record, a Rephaser computes the (nrow, nchan) phasor for a whole chunk
+of records in one shot.
+"""
+
+import numpy as np
+
+__all__ = 'Rephaser lmn'.split ()
+
+TWOPI = 2 * np.pi
+
+
+def lmn (ra0, dec0, ra, dec):
+    """Direction cosines of (ra, dec) relative to the phase center (ra0,
+    dec0), all in radians, with 1 subtracted from n so that the phase
+    of the phase center is zero. Copied from mmm/hex/hex-lib-calcgainerr."""
+    dra = ra - ra0
+    l = np.sin (dra) * np.cos (dec)
+    m = np.sin (dec) * np.cos (dec0) - np.cos (dra) * np.cos (dec) * np.sin (dec0)
+    n = np.sin (dec) * np.sin (dec0) + np.cos (dra) * np.cos (dec) * np.cos (dec0)
+    n -= 1 # makes the work below easier
+    return np.asarray ([l, m, n])
+
+
+class Rephaser (object):
+    """Computes phasors exp(-2 pi i (lmn . uvw) nu) for chunks of records.
+
+    lmn    - as computed by lmn ()
+    single - if True, produce complex64 phasors. The phase arguments are
+             still computed and range-reduced in double precision, but
+             the trigonometry is done in single precision, which is
+             plenty when the data themselves are complex64.
+
+    Frequencies are in whatever units make (uvw * freqs) come out in
+    wavelengths. The frequency factors are cached by the "key" argument
+    of phasor() and apply(), which should be something like a spectral
+    window ID; with key=None nothing is cached. apply() always works in
+    single precision on complex64 data, since the extra precision of a
+    double-precision phasor would be rounded away anyway.
+    """
+
+    def __init__ (self, lmn, single=False):
+        self.lmn = np.asarray (lmn, dtype=np.double)
+        self.single = single
+        self._freqfactors = {}
+
+    def _freqfactor (self, freqs, key):
+        if key is None:
+            return -TWOPI * np.asarray (freqs, dtype=np.double)
+
+        ff = self._freqfactors.get (key)
+        if ff is None:
+            ff = self._freqfactors[key] = -TWOPI * np.asarray (freqs, dtype=np.double)
+        return ff
+
+    def phasor (self, uvw, freqs, key=None, single=None):
+        """uvw is (3, nrow), freqs is (nchan,); returns (nrow, nchan). If
+        single is None, self.single is used."""
+        arg = np.outer (np.dot (self.lmn, uvw), self._freqfactor (freqs, key))
+
+        if single is None:
+            single = self.single
+
+        if not single:
+            ph = np.empty (arg.shape, dtype=np.complex128)
+            np.cos (arg, ph.real)
+            np.sin (arg, ph.imag)
+            return ph
+
+        arg -= TWOPI * np.round (arg / TWOPI)
+        arg = arg.astype (np.float32)
+        ph = np.empty (arg.shape, dtype=np.complex64)
+        np.cos (arg, ph.real)
+        np.sin (arg, ph.imag)
+        return ph
+
+    def apply (self, data, uvw, freqs, key=None):
+        """Rephase data of shape (..., nrow, nchan) in place and return it."""
+        single = self.single or data.dtype == np.complex64
+        data *= self.phasor (uvw, freqs, key, single)
+        return data
@@ -0,0 +1,120 @@
+# Copyright 2013 Peter Williams
+# Licensed under the GNU General Public License version 3 or higher
+
+"""procpool - run independent jobs in a process pool, in order
+
+For command-line tools that do the same thing to many files, like
+imstats and iminfo. Each job is a call func (*args); the results come
+back in the order the jobs were given, and anything a job prints to
+stdout or stderr is captured in the worker and replayed in the parent
+just before its result is returned, so that the output looks the same
+as if the jobs had been run one after the other. A SystemExit in a
+job (e.g. from die()) is re-raised in the parent at the same point.
+
+popjobs() handles the conventional "-jNN" command-line option.
+"""
+
+import sys
+
+__all__ = 'popjobs imap_ordered OrderedJobs'.split ()
+
+
+def popjobs (argv=None):
+    """Remove a "-jNN" option from argv (sys.argv by default) and return
+    the number of workers it specifies: 1 if it's absent, and None
+    (meaning one per CPU) for a bare "-j"."""
+    if argv is None:
+        from sys import argv
+
+    workers = 1
+
+    for arg in list (argv[1:]):
+        if arg == '-j' or (arg.startswith ('-j') and arg[2:].isdigit ()):
+            workers = int (arg[2:] or 0) or None
+            argv.remove (arg)
+
+    return workers
+
+
+def _call (job):
+    func, args = job
+    from cStringIO import StringIO
+    saved = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = out, err = StringIO (), StringIO ()
+    exit = None
+
+    try:
+        result = func (*args)
+    except SystemExit as e:
+        result = None
+        exit = (e.code, )
+    finally:
+        sys.stdout, sys.stderr = saved
+
+    return out.getvalue (), err.getvalue (), result, exit
+
+
+def _replay (item):
+    out, err, result, exit = item
+    sys.stdout.flush ()
+    sys.stderr.write (err)
+    sys.stdout.write (out)
+    sys.stdout.flush ()
+
+    if exit is not None:
+        raise SystemExit (exit[0])
+    return result
+
+
+class OrderedJobs (object):
+    """Run func (*args) for each tuple in arglists in a pool of workers
+    processes (None meaning one per CPU). Iterating blocks for each
+    result in turn; poll() returns the results that are ready without
+    blocking."""
+
+    def __init__ (self, func, arglists, workers=None):
+        from multiprocessing import Pool
+        jobs = [(func, tuple (args)) for args in arglists]
+        self.nleft = len (jobs)
+        self._pool = Pool (workers)
+        self._it = self._pool.imap (_call, jobs)
+        self._pool.close ()
+
+
+    def __iter__ (self):
+        try:
+            while self.nleft:
+                self.nleft -= 1
+                yield _replay (self._it.next ())
+        finally:
+            self.terminate ()
+
+
+    def poll (self):
+        from multiprocessing import TimeoutError
+        results = []
+
+        while self.nleft:
+            try:
+                item = self._it.next (0)
+            except TimeoutError:
+                break
+            self.nleft -= 1
+            results.append (_replay (item))
+
+        return results
+
+
+    def terminate (self):
+        if self._pool is not None:
+            self._pool.terminate ()
+            self._pool = None
+
+
+def imap_ordered (func, arglists, workers=1):
+    """Yield func (*args) for each tuple in arglists, in order. If
+    workers is 1, the calls are made lazily in this process; otherwise
+    they're run in an OrderedJobs pool."""
+    if workers == 1:
+        return (func (*args) for args in arglists)
+    return iter (OrderedJobs (func, arglists, workers))
@@ -132,6 +132,44 @@ class AstroImage (object):
         raise NotImplementedError ()
 
 
+    def read_region (self, slices, squeeze=False, flip=False):
+        """Read part of the image. slices is a tuple of ints and slices as
+        in numpy indexing, with unspecified trailing axes read in full.
+        The result is the same as read (flip=flip)[slices], but backends
+        only read the box of pixels that is needed."""
+        self._checkOpen ()
+        blc, trc, rel = _region_box (slices, self.shape, flip)
+
+        if (trc <= blc).any ():
+            data = np.ma.empty (trc - blc, dtype=np.float32)
+        else:
+            data = self._readbox (blc, trc)
+
+        if flip:
+            data = data[...,::-1,:]
+        data = data[rel]
+        if squeeze:
+            data = data.squeeze ()
+        return data
+
+
+    def read_plane (self, index, flip=False):
+        """Read the 2D plane at index, a sequence of integer pixel
+        coordinates for the axes before the last two."""
+        index = tuple (index)
+        if len (index) != self.shape.size - 2:
+            raise ValueError ('plane index must have %d elements; got %d' \
+                                  % (self.shape.size - 2, len (index)))
+        return self.read_region (index, flip=flip)
+
+
+    def _readbox (self, blc, trc):
+        # Read the pixels [blc:trc] (trc exclusive) in native
+        # orientation. Backends override this to avoid reading the
+        # whole image.
+        return self.read ()[_box_slices (blc, trc)]
+
+
     def write (self, data):
         raise NotImplementedError ()
 
@@ -144,6 +182,48 @@ class AstroImage (object):
         raise NotImplementedError ()
 
 
+    def toworld_many (self, pixels):
+        """Convert an (N, naxis) array of pixel coordinates to an (N,
+        naxis) array of world coordinates. Backends that can do so
+        make a single call into their coordinate library; this default
+        just loops over toworld()."""
+        pixels = _check_many (pixels, self.shape.size, 'pixel')
+        world = np.empty (pixels.shape)
+        for i in xrange (pixels.shape[0]):
+            world[i] = self.toworld (pixels[i])
+        return world
+
+
+    def topixel_many (self, world):
+        """The inverse of toworld_many()."""
+        world = _check_many (world, self.shape.size, 'world')
+        pixels = np.empty (world.shape)
+        for i in xrange (world.shape[0]):
+            pixels[i] = self.topixel (world[i])
+        return pixels
+
+
+    def pixel_grid_world (self, y0, y1, x0, x1, pixel=None):
+        """World coordinates of the rectangular patch of pixels [y0:y1,
+        x0:x1] in the last two axes of the image, as an array of shape
+        (y1 - y0, x1 - x0, naxis). The pixel coordinates of any other
+        axes are taken from pixel, defaulting to zero."""
+        naxis = self.shape.size
+        if naxis < 2:
+            raise ValueError ('need at least two axes for a pixel grid')
+
+        if pixel is None:
+            pixel = np.zeros (naxis)
+        ny = max (y1 - y0, 0)
+        nx = max (x1 - x0, 0)
+
+        pixels = np.empty ((ny, nx, naxis))
+        pixels[...] = pixel
+        pixels[...,-2] = np.arange (y0, y0 + ny)[:,np.newaxis]
+        pixels[...,-1] = np.arange (x0, x0 + nx)
+        return self.toworld_many (pixels.reshape ((-1, naxis))).reshape (pixels.shape)
+
+
     def simple (self):
         if self._latax == 0 and self._lonax == 1 and self.shape.size == 2:
             return self # noop
@@ -199,18 +279,83 @@ def _get_wcs_scale (wcs, naxis):
     return wcscale
 
 
-def _wcs_toworld (wcs, pixel, wcscale, naxis):
-    # TODO: we don't allow the usage of "SIP" or "Paper IV"
-    # transformations, let alone a concatenation of these, because
-    # they're not invertible.
+def _region_box (slices, shape, flip):
+    """Turn a numpy-style tuple of ints and slices into the bounding box
+    blc, trc (trc exclusive) of the pixels it selects, and a tuple of
+    indexers to apply to that box once it's been read (and flipped, if
+    flip is True)."""
+    import operator
+
+    if not isinstance (slices, tuple):
+        slices = (slices, )
+
+    naxis = shape.size
+    if len (slices) > naxis:
+        raise IndexError ('too many indices for a %d-dimensional image' % naxis)
+
+    blc = np.zeros (naxis, dtype=np.int)
+    trc = np.zeros (naxis, dtype=np.int)
+    rel = []
+
+    for i in xrange (naxis):
+        n = shape[i]
+        s = slices[i] if i < len (slices) else slice (None)
+
+        if isinstance (s, slice):
+            start, stop, step = s.indices (n)
+            r = xrange (start, stop, step)
+
+            if len (r) == 0:
+                lo = hi = 0
+                rel.append (slice (0, 0))
+            else:
+                lo = min (r[0], r[-1])
+                hi = max (r[0], r[-1]) + 1
+                relstop = r[-1] + step - lo
+                if relstop < 0:
+                    relstop = None
+                rel.append (slice (r[0] - lo, relstop, step))
+        else:
+            try:
+                idx = operator.index (s)
+            except TypeError:
+                raise TypeError ('image regions must be specified with ints '
+                                 'and slices; got %r' % (s, ))
+
+            if idx < 0:
+                idx += n
+            if idx < 0 or idx >= n:
+                raise IndexError ('index %d out of bounds for axis %d with '
+                                  'size %d' % (s, i, n))
+            lo, hi = idx, idx + 1
+            rel.append (0)
+
+        if flip and i == naxis - 2:
+            lo, hi = n - hi, n - lo
+
+        blc[i] = lo
+        trc[i] = hi
 
+    return blc, trc, tuple (rel)
+
+
+def _box_slices (blc, trc):
+    return tuple (slice (b, t) for b, t in zip (blc, trc))
+
+
+def _check_many (coords, naxis, kind):
+    coords = np.asarray (coords, dtype=np.double)
+    if coords.ndim != 2 or coords.shape[1] != naxis:
+        raise ValueError ('%s coordinates must be an (N, %d) array' % (kind, naxis))
+    return coords
+
+
+def _wcs_toworld (wcs, pixel, wcscale, naxis):
     pixel = np.asarray (pixel)
     if pixel.shape != (naxis, ):
         raise ValueError ('pixel coordinate must be a %d-element vector', naxis)
 
-    pixel = pixel.reshape ((1, naxis))[:,::-1]
-    world = wcs.wcs_pix2sky (pixel, 0)
-    return world[0,::-1] * wcscale
+    return _wcs_toworld_many (wcs, pixel.reshape ((1, naxis)), wcscale, naxis)[0]
 
 
 def _wcs_topixel (wcs, world, wcscale, naxis):
@@ -218,9 +363,29 @@ def _wcs_topixel (wcs, world, wcscale, naxis):
     if world.shape != (naxis, ):
         raise ValueError ('world coordinate must be a %d-element vector', naxis)
 
-    world = (world / wcscale)[::-1].reshape ((1, naxis))
-    pixel = wcs.wcs_sky2pix (world, 0)
-    return pixel[0,::-1]
+    return _wcs_topixel_many (wcs, world.reshape ((1, naxis)), wcscale, naxis)[0]
+
+
+def _wcs_toworld_many (wcs, pixels, wcscale, naxis):
+    # TODO: we don't allow the usage of "SIP" or "Paper IV"
+    # transformations, let alone a concatenation of these, because
+    # they're not invertible.
+
+    pixels = _check_many (pixels, naxis, 'pixel')
+    if pixels.shape[0] == 0:
+        return pixels.copy ()
+
+    world = wcs.wcs_pix2sky (pixels[:,::-1], 0)
+    return world[:,::-1] * wcscale
+
+
+def _wcs_topixel_many (wcs, world, wcscale, naxis):
+    world = _check_many (world, naxis, 'world')
+    if world.shape[0] == 0:
+        return world.copy ()
+
+    pixels = wcs.wcs_sky2pix ((world / wcscale)[:,::-1], 0)
+    return pixels[:,::-1].copy ()
 
 
 def _wcs_axes (wcs, naxis):
@@ -339,6 +504,29 @@ class MIRIADImage (AstroImage):
         return data
 
 
+    def _readbox (self, blc, trc):
+        # MIRIAD can only read whole planes, so we read the planes that
+        # intersect the box into a scratch buffer one at a time.
+        ys = slice (blc[-2], trc[-2])
+        xs = slice (blc[-1], trc[-1])
+
+        if self.shape.size == 2:
+            return self._handle.readPlane ([])[ys,xs].copy ()
+
+        plane = np.ma.empty (self.shape[-2:], dtype=np.float32)
+        plane.mask = np.zeros (self.shape[-2:], dtype=np.bool)
+        data = np.ma.empty (trc - blc, dtype=np.float32)
+        data.mask = np.zeros (trc - blc, dtype=np.bool)
+
+        for idx in np.ndindex (*(trc[:-2] - blc[:-2])):
+            # Must convert from C to Fortran indexing convention
+            axes = [int (a) for a in (blc[:-2] + idx)[::-1]]
+            self._handle.readPlane (axes, plane)
+            data[idx] = plane[ys,xs]
+
+        return data
+
+
     def write (self, data):
         data = np.ma.asarray (data)
 
@@ -382,6 +570,22 @@ class MIRIADImage (AstroImage):
         return _wcs_topixel (self._wcs, world, self._wcscale, self.shape.size)
 
 
+    def toworld_many (self, pixels):
+        if self._wcs is None:
+            raise UnsupportedError ('world coordinate information is required '
+                                    'but not present in "%s"', self.path)
+
+        return _wcs_toworld_many (self._wcs, pixels, self._wcscale, self.shape.size)
+
+
+    def topixel_many (self, world):
+        if self._wcs is None:
+            raise UnsupportedError ('world coordinate information is required '
+                                    'but not present in "%s"', self.path)
+
+        return _wcs_topixel_many (self._wcs, world, self._wcscale, self.shape.size)
+
+
     def saveCopy (self, path, overwrite=False, openmode=None):
         import shutil, os.path
 
@@ -592,6 +796,11 @@ class PyrapImage (AstroImage):
         return data
 
 
+    def _readbox (self, blc, trc):
+        return self._handle.get ([int (x) for x in blc],
+                                 [int (x) - 1 for x in trc]) # inclusive
+
+
     def write (self, data):
         data = np.ma.asarray (data)
 
@@ -745,6 +954,16 @@ class CasaCImage (AstroImage):
         return data
 
 
+    def _readbox (self, blc, trc):
+        cblc = [int (x) for x in blc[::-1]]
+        ctrc = [int (x) - 1 for x in trc[::-1]] # inclusive
+
+        data = self._handle.getchunk (cblc, ctrc, getmask=False).T
+        mask = self._handle.getchunk (cblc, ctrc, getmask=True)
+        np.logical_not (mask, mask)
+        return np.ma.MaskedArray (data, mask=mask.T)
+
+
     def write (self, data):
         self._checkOpen ()
         self._checkWriteable ()
@@ -797,6 +1016,43 @@ class CasaCImage (AstroImage):
         return casapixel[::-1].copy ()
 
 
+    # The coordsys tool can convert many coordinates at once; its arrays
+    # are (naxis, N) in CASA axis ordering.
+
+    def toworld_many (self, pixels):
+        self._checkOpen ()
+        pixels = _check_many (pixels, self.shape.size, 'pixel')
+        if pixels.shape[0] == 0:
+            return pixels.copy ()
+
+        cs = self._handle.coordsys ()
+        try:
+            casaworld = cs.toworldmany (pixels[:,::-1].T.copy ())['numeric']
+        finally:
+            cs.done ()
+
+        return np.asarray (casaworld)[self._pax2wax].T.copy ()
+
+
+    def topixel_many (self, world):
+        self._checkOpen ()
+        world = _check_many (world, self.shape.size, 'world')
+        if world.shape[0] == 0:
+            return world.copy ()
+
+        ncwa = self._wax2pax.size
+        casaworld = np.zeros ((ncwa, world.shape[0]))
+        casaworld[self._pax2wax] = world.T
+
+        cs = self._handle.coordsys ()
+        try:
+            casapixel = cs.topixelmany (casaworld)['numeric']
+        finally:
+            cs.done ()
+
+        return np.asarray (casapixel)[::-1].T.copy ()
+
+
     def saveCopy (self, path, overwrite=False, openmode=None):
         self._checkOpen ()
 
@@ -849,6 +1105,14 @@ except ImportError:
         CASAImage = _CasaUnsupportedImage
 
 
+def _fits_masked (data):
+    # Copy out of the memmap, so that the result survives the file
+    # being closed, and only build the mask for the pixels we've read.
+    # Are there other standards for expressing masking in FITS?
+    data = np.array (data)
+    return np.ma.MaskedArray (data, mask=~np.isfinite (data))
+
+
 class FITSImage (AstroImage):
     _modemap = {'r': 'readonly',
                 'rw': 'update' # ???
@@ -875,7 +1139,8 @@ class FITSImage (AstroImage):
 
         super (FITSImage, self).__init__ (path, mode)
 
-        self._handle = pyfits.open (path, self._modemap[mode])
+        # With memmap, read_region() only touches the pages it needs.
+        self._handle = pyfits.open (path, self._modemap[mode], memmap=True)
         header = self._handle[0].header
         self._wcs = pywcs.WCS (header)
         self._wcs.wcs.set ()
@@ -928,9 +1193,7 @@ class FITSImage (AstroImage):
 
     def read (self, squeeze=False, flip=False):
         self._checkOpen ()
-        data = np.ma.asarray (self._handle[0].data)
-        # Are there other standards for expressing masking in FITS?
-        data.mask = -np.isfinite (data.data)
+        data = _fits_masked (self._handle[0].data)
 
         if flip:
             data = data[...,::-1,:]
@@ -939,6 +1202,10 @@ class FITSImage (AstroImage):
         return data
 
 
+    def _readbox (self, blc, trc):
+        return _fits_masked (self._handle[0].data[_box_slices (blc, trc)])
+
+
     def write (self, data):
         data = np.ma.asarray (data)
 
@@ -967,6 +1234,22 @@ class FITSImage (AstroImage):
         return _wcs_topixel (self._wcs, world, self._wcscale, self.shape.size)
 
 
+    def toworld_many (self, pixels):
+        if self._wcs is None:
+            raise UnsupportedError ('world coordinate information is required '
+                                    'but not present in "%s"', self.path)
+
+        return _wcs_toworld_many (self._wcs, pixels, self._wcscale, self.shape.size)
+
+
+    def topixel_many (self, world):
+        if self._wcs is None:
+            raise UnsupportedError ('world coordinate information is required '
+                                    'but not present in "%s"', self.path)
+
+        return _wcs_topixel_many (self._wcs, world, self._wcscale, self.shape.size)
+
+
     def saveCopy (self, path, overwrite=False, openmode=None):
         self._checkOpen ()
         self._handle.writeto (path, output_verify='fix', clobber=overwrite)
@@ -1069,6 +1352,23 @@ class SimpleImage (AstroImage):
         return data
 
 
+    def _readbox (self, blc, trc):
+        pblc = self._pctmpl.astype (np.int)
+        ptrc = pblc + 1
+        lat, lon = self._platax, self._plonax
+        pblc[lat], ptrc[lat] = blc[0], trc[0]
+        pblc[lon], ptrc[lon] = blc[1], trc[1]
+
+        idx = list (self._pctmpl.astype (np.int) - pblc)
+        idx[lat] = slice (None)
+        idx[lon] = slice (None)
+        data = self._handle._readbox (pblc, ptrc)[tuple (idx)]
+
+        if lat > lon:
+            data = data.T
+        return data
+
+
     def write (self, data):
         data = np.ma.asarray (data)
 
@@ -1122,6 +1422,33 @@ class SimpleImage (AstroImage):
         return pixel
 
 
+    def toworld_many (self, pixels):
+        self._checkOpen ()
+        pixels = _check_many (pixels, 2, 'pixel')
+        p = np.empty ((pixels.shape[0], self._pctmpl.size))
+        p[:] = self._pctmpl
+        p[:,self._platax] = pixels[:,0]
+        p[:,self._plonax] = pixels[:,1]
+        w = self._handle.toworld_many (p)
+        return w[:,[self._platax, self._plonax]]
+
+
+    def topixel_many (self, world):
+        self._checkOpen ()
+        if not self._topixelok:
+            raise UnsupportedError ('mixing in the coordinate system of '
+                                    'this subimage prevents mapping from '
+                                    'world to pixel coordinates')
+
+        world = _check_many (world, 2, 'world')
+        w = np.empty ((world.shape[0], self._wctmpl.size))
+        w[:] = self._wctmpl
+        w[:,self._platax] = world[:,0]
+        w[:,self._plonax] = world[:,1]
+        p = self._handle.topixel_many (w)
+        return p[:,[self._platax, self._plonax]]
+
+
     def simple (self):
         return self
 
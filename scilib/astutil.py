@@ -399,6 +399,10 @@ def gaussianDeconvolve (smaj, smin, spa, bmaj, bmin, bpa):
     Return units are consistent with the inputs.
     status is one of 'ok', 'pointlike', 'fail'
 
+    The arguments may also be arrays, which are broadcast against each
+    other, to deconvolve many sources at once. In that case all of the
+    return values are arrays, status being an array of strings.
+
     Derived from miriad gaupar.for:GauDfac()
 
     We currently don't do a great job of dealing with pointlike
@@ -407,12 +411,15 @@ def gaussianDeconvolve (smaj, smin, spa, bmaj, bmin, bpa):
     0.5. Feel a little wary about that first change.
     """
 
-    from numpy import cos, sin, sqrt, min, abs, arctan2
+    from numpy import cos, sin, sqrt, abs, arctan2, minimum, where
+
+    args = (smaj, smin, spa, bmaj, bmin, bpa)
+    scalar = all (np.ndim (a) == 0 for a in args)
+    smaj, smin, spa, bmaj, bmin, bpa = \
+        np.broadcast_arrays (*[np.asarray (a, dtype=np.double) for a in args])
 
-    if smaj < bmaj:
-        smaj = bmaj
-    if smin < bmin:
-        smin = bmin
+    smaj = np.maximum (smaj, bmaj)
+    smin = np.maximum (smin, bmin)
 
     alpha = ((smaj * cos (spa))**2 + (smin * sin (spa))**2 -
              (bmaj * cos (bpa))**2 - (bmin * sin (bpa))**2)
@@ -423,26 +430,22 @@ def gaussianDeconvolve (smaj, smin, spa, bmaj, bmin, bpa):
 
     s = alpha + beta
     t = sqrt ((alpha - beta)**2 + gamma**2)
-    limit = 0.5 * min ([smaj, smin, bmaj, bmin])**2
+    limit = 0.5 * minimum (minimum (smaj, smin), minimum (bmaj, bmin))**2
     #limit = 0.1 * min ([smaj, smin, bmaj, bmin])**2
-    status = 'ok'
 
-    if alpha < 0 or beta < 0 or s < t:
-        dmaj = dmin = dpa = 0
+    bad = (alpha < 0) | (beta < 0) | (s < t)
+    pointlike = bad & (0.5 * (s - t) < limit) & (alpha > -limit) & (beta > -limit)
+    status = where (bad, where (pointlike, 'pointlike', 'fail'), 'ok')
 
-        if 0.5 * (s - t) < limit and alpha > -limit and beta > -limit:
-            status = 'pointlike'
-        else:
-            status = 'fail'
-    else:
-        dmaj = sqrt (0.5 * (s + t))
-        dmin = sqrt (0.5 * (s - t))
+    with np.errstate (invalid='ignore'):
+        dmaj = where (bad, 0., sqrt (0.5 * (s + t)))
+        dmin = where (bad, 0., sqrt (0.5 * (s - t)))
 
-        if abs (gamma) + abs (alpha - beta) == 0:
-            dpa = 0
-        else:
-            dpa = 0.5 * arctan2 (-gamma, alpha - beta)
+    dpa = where (bad | (abs (gamma) + abs (alpha - beta) == 0), 0.,
+                 0.5 * arctan2 (-gamma, alpha - beta))
 
+    if scalar:
+        return float (dmaj), float (dmin), float (dpa), str (status)
     return dmaj, dmin, dpa, status
 
 
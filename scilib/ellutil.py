@@ -23,10 +23,10 @@ axis.
 TODO: figure out if nf is actually helpful; improve it, remove it, or
 document it.
 
-Possible TODO: make more array-friendly. All of the bounds-checking
-becomes a pain (e.g. need to wrap in np.any()) to make array-friendly
-while still providing useful debug output. np.vectorize() might save
-the day here.
+The basic functions work on scalars and raise exceptions with useful
+debug output on bad inputs. For catalog-scale work, the *_many()
+variants take arrays and return masked arrays, masking the entries for
+bad inputs instead.
 """
 
 import numpy as np
@@ -35,7 +35,9 @@ __all__ = ('F2S S2F sigmascale clscale '
            'bivell bivnorm bivabc bivnf databiv bivrandom bivplot '
            'ellnorm ellpoint elld2 ellbiv ellabc ellplot '
            'nfabc nfell nfd2 nfplot '
-           'abcell abcd2 abcnf abcplot').split ()
+           'abcell abcd2 abcnf abcplot '
+           'bivok ellok abcok ellnorm_many bivell_many ellbiv_many '
+           'ellabc_many abcell_many').split ()
 
 
 # Some utilities for scaling ellipse axis lengths
@@ -507,3 +509,115 @@ def nfd2 (x0, y0, u, v, w, x, y):
 
 def nfplot (u, v, w, **kwargs):
     return ellplot (*nfell (u, v, w), **kwargs)
+
+
+# Array versions. These take arrays (or scalars) that are broadcast
+# against each other, and return masked arrays in which the entries for
+# degenerate or illegal inputs are masked, rather than raising
+# exceptions, so that whole catalogs can be converted at once. The
+# *ok() functions are the array counterparts of the _*check()
+# validators.
+
+def _arrays (*args):
+    return np.broadcast_arrays (*[np.asarray (a, dtype=np.double) for a in args])
+
+
+def _masked (bad, *vals):
+    return tuple (np.ma.MaskedArray (v, mask=bad | ~np.isfinite (v))
+                  for v in vals)
+
+
+def bivok (sx, sy, cxy):
+    sx, sy, cxy = _arrays (sx, sy, cxy)
+    return (sx > 0) & (sy > 0) & (np.abs (cxy) < sx * sy)
+
+
+def ellok (maj, min, pa):
+    maj, min, pa = _arrays (maj, min, pa)
+    return (maj > 0) & (min > 0) & (min <= maj)
+
+
+def abcok (a, b, c):
+    a, b, c = _arrays (a, b, c)
+    return (a < 0) & (c < 0) & (b**2 < 4 * a * c)
+
+
+def ellnorm_many (maj, min, pa):
+    """Array version of ellnorm()."""
+    maj, min, pa = _arrays (maj, min, pa)
+    bad = ~((maj > 0) & (min > 0))
+    hp = 0.5 * np.pi
+
+    swap = min > maj
+    maj, min = np.where (swap, min, maj), np.where (swap, maj, min)
+    pa = np.where (swap, pa + hp, pa)
+    pa = (pa + hp) % np.pi - hp
+    return _masked (bad, maj, min, pa)
+
+
+def bivell_many (sx, sy, cxy):
+    """Array version of bivell()."""
+    sx, sy, cxy = _arrays (sx, sy, cxy)
+    bad = ~bivok (sx, sy, cxy)
+    sx2, sy2, cxy2 = sx**2, sy**2, cxy**2
+
+    with np.errstate (invalid='ignore', divide='ignore'):
+        pa = 0.5 * np.arctan2 (2 * cxy, sx2 - sy2)
+        h = np.sqrt ((sx2 - sy2)**2 + 4 * cxy2)
+        tmaj = 2 * (sx2 * sy2 - cxy2) / (sx2 + sy2 - h)
+        tmin = 2 * (sx2 * sy2 - cxy2) / (sx2 + sy2 + h)
+        bad |= (tmaj < 0) | (tmin < 0)
+        maj = np.sqrt (np.where (bad, 1., tmaj))
+        min = np.sqrt (np.where (bad, 1., tmin))
+
+    maj, min, pa = ellnorm_many (maj, min, pa)
+    return _masked (bad | maj.mask, maj.data, min.data, pa.data)
+
+
+def ellbiv_many (maj, min, pa):
+    """Array version of ellbiv()."""
+    maj, min, pa = _arrays (maj, min, pa)
+    bad = ~ellok (maj, min, pa)
+    cpa, spa = np.cos (pa), np.sin (pa)
+    maj2, min2 = maj**2, min**2
+
+    with np.errstate (invalid='ignore'):
+        sx = np.sqrt (maj2 * cpa**2 + min2 * spa**2)
+        sy = np.sqrt (maj2 * spa**2 + min2 * cpa**2)
+    cxy = (maj2 - min2) * cpa * spa
+
+    bad |= ~bivok (sx, sy, cxy)
+    return _masked (bad, sx, sy, cxy)
+
+
+def ellabc_many (maj, min, pa):
+    """Array version of ellabc()."""
+    maj, min, pa = _arrays (maj, min, pa)
+    bad = ~ellok (maj, min, pa)
+    cpa, spa = np.cos (pa), np.sin (pa)
+
+    with np.errstate (divide='ignore'):
+        majm2, minm2 = maj**-2, min**-2
+
+    a = -0.5 * (cpa**2 * majm2 + spa**2 * minm2)
+    c = -0.5 * (spa**2 * majm2 + cpa**2 * minm2)
+    b = cpa * spa * (minm2 - majm2)
+
+    bad |= ~abcok (a, b, c)
+    return _masked (bad, a, b, c)
+
+
+def abcell_many (a, b, c):
+    """Array version of abcell()."""
+    a, b, c = _arrays (a, b, c)
+    bad = ~abcok (a, b, c)
+    pa = 0.5 * np.arctan2 (b, a - c)
+    t1 = np.sqrt ((a - c)**2 + b**2)
+    tmaj = -t1 - a - c
+    tmin = t1 - a - c
+    bad |= (tmaj <= 0) | (tmin <= 0)
+
+    maj = np.where (bad, 1., tmaj)**-0.5
+    min = np.where (bad, 1., tmin)**-0.5
+    maj, min, pa = ellnorm_many (maj, min, pa)
+    return _masked (bad | maj.mask, maj.data, min.data, pa.data)
@@ -36,6 +36,7 @@ import glib, gtk # FIXME: might want LazyComputer et al without an X server
 
 
 DEFAULT_TILESIZE = 128
+DEFAULT_LUTSIZE = 4096
 
 class LazyComputer (object):
     buffer = None
@@ -144,10 +145,20 @@ class Clipper (LazyComputer):
 
 
 class ColorMapper (LazyComputer):
-    def __init__ (self, mapname):
+    """If lutsize is nonzero, data are colored by lookup in a table of
+    that many precomputed ARGB values, which is much faster than
+    evaluating the colormap on every tile. With lutsize=0 the colormap
+    function is evaluated directly."""
+
+    lut = None
+
+    def __init__ (self, mapname, lutsize=DEFAULT_LUTSIZE):
         import colormaps
         self.mapper = colormaps.factory_map[mapname]()
 
+        if lutsize:
+            self.lut = colormaps.get_argb_lut (mapname, lutsize)
+
 
     def allocBuffer (self, template):
         self.buffer = np.empty (template.shape, dtype=np.uint32)
@@ -156,6 +167,9 @@ class ColorMapper (LazyComputer):
 
 
     def _makeFunc (self, ismasked):
+        if self.lut is not None:
+            return self._makeLUTFunc (ismasked)
+
         mapper = self.mapper
         # I used to preallocate this scratch array, but doing
         # "np.multiply (mapped[:,:,0], 0xFF, effscratch)" causes
@@ -209,6 +223,21 @@ class ColorMapper (LazyComputer):
         return func
 
 
+    def _makeLUTFunc (self, ismasked):
+        from colormaps import apply_argb_lut
+        lut = self.lut
+
+        if not ismasked:
+            def func (src, dest):
+                apply_argb_lut (lut, src, dest)
+        else:
+            def func (src, dest):
+                apply_argb_lut (lut, src.data, dest)
+                dest[src.mask] = 0
+
+        return func
+
+
 DRAG_TYPE_NONE = 0
 DRAG_TYPE_PAN = 1
 DRAG_TYPE_TUNER = 2
@@ -892,6 +921,19 @@ class Cycler (Viewer):
         self.viewport.queue_draw ()
 
 
+    def refresh (self):
+        """Call if the number of arrays or their contents have changed."""
+        n = self.getn ()
+        self.needtune = np.ones (n, dtype=np.bool_)
+        self.viewport.setTuningSetter (self._set_tuning)
+
+        if self.i is not None:
+            self.plane_label.set_markup ('<b>Current plane:</b> %d of %d' %
+                                         (self.i + 1, n))
+
+        self.viewport.queue_draw ()
+
+
     def _on_realize (self, widget):
         if self.sourceid is not None:
             return
@@ -932,60 +974,87 @@ class Cycler (Viewer):
 
 
 def cycle (arrays, descs=None, cadence=0.6, toworlds=None,
-           drawoverlay=None, yflip=False):
+           drawoverlay=None, yflip=False, getmore=None):
+    """If getmore is not None, it is polled while the window is up so
+    that more arrays can be added as they become available. It should
+    return a list of (array, desc, toworld) tuples, which may be empty,
+    or None once no more arrays are coming. The masks of arrays already
+    being shown may also be changed when it is called."""
     import time, glib
 
+    arrays = list (arrays)
     n = len (arrays)
-    amin = amax = h = w = None
 
     if descs is None:
         descs = [''] * n
+    descs = list (descs)
 
-    for array in arrays:
-        thish, thisw = array.shape
-        thismin, thismax = array.min (), array.max ()
+    if toworlds is None:
+        toworlds = [None] * n
+    toworlds = list (toworlds)
 
-        if not np.isfinite (thismin):
-            thismin = array[np.ma.where (np.isfinite (array))].min ()
-        if not np.isfinite (thismax):
-            thismax = array[np.ma.where (np.isfinite (array))].max ()
+    h, w = arrays[0].shape
+    stride = cairo.ImageSurface.format_stride_for_width (cairo.FORMAT_ARGB32, w)
+    # stride is in bytes:
+    assert stride % 4 == 0
+    imgdata = []
+    fixed = []
+    antimask = []
+    surfaces = []
+    nomasks = []
+
+    def load ():
+        # (Re)compute the scaled data for every array, since the overall
+        # data range and the masks may change as arrays are added.
+        amin = amax = None
+
+        for array in arrays:
+            thish, thisw = array.shape
+            thismin, thismax = array.min (), array.max ()
+
+            if not np.isfinite (thismin):
+                thismin = array[np.ma.where (np.isfinite (array))].min ()
+            if not np.isfinite (thismax):
+                thismax = array[np.ma.where (np.isfinite (array))].max ()
 
-        if amin is None:
-            w, h, amin, amax = thisw, thish, thismin, thismax
-        else:
             if thisw != w:
                 raise ValueError ('array widths not all equal')
             if thish != h:
                 raise ValueError ('array heights not all equal')
 
-            amin = min (amin, thismin)
-            amax = max (amax, thismax)
-
-    stride = cairo.ImageSurface.format_stride_for_width (cairo.FORMAT_ARGB32, w)
-    # stride is in bytes:
-    assert stride % 4 == 0
-    imgdata = np.empty ((n, h, stride // 4), dtype=np.uint32)
-    fixed = np.empty ((n, h, w), dtype=np.int32)
-    antimask = np.empty ((n, h, w), dtype=np.bool_)
-    surfaces = [None] * n
+            if amin is None:
+                amin, amax = thismin, thismax
+            else:
+                amin = min (amin, thismin)
+                amax = max (amax, thismax)
+
+        for i, array in enumerate (arrays):
+            if i == len (imgdata):
+                imgdata.append (np.empty ((h, stride // 4), dtype=np.uint32))
+                imgdata[i].fill (0xFF000000)
+                fixed.append (np.empty ((h, w), dtype=np.int32))
+                antimask.append (np.empty ((h, w), dtype=np.bool_))
+                surfaces.append (cairo.ImageSurface.create_for_data (imgdata[i],
+                                                                     cairo.FORMAT_ARGB32,
+                                                                     w, h, stride))
+
+            if np.ma.is_masked (array):
+                filled = array.filled (amin)
+                antimask[i][:] = ~array.mask
+            else:
+                filled = array
+                antimask[i].fill (True)
 
-    imgdata.fill (0xFF000000)
+            fixed[i][:] = (filled - amin) * (0x0FFFFFF0 / (amax - amin))
 
-    for i, array in enumerate (arrays):
-        surfaces[i] = cairo.ImageSurface.create_for_data (imgdata[i], cairo.FORMAT_ARGB32,
-                                                          w, h, stride)
+        # see comment in view()
+        nomasks[:] = [not np.ma.is_masked (a) or a.mask is np.ma.nomask
+                      for a in arrays]
 
-        if np.ma.is_masked (array):
-            filled = array.filled (amin)
-            antimask[i] = ~array.mask
-        else:
-            filled = array
-            antimask[i].fill (True)
-
-        fixed[i] = (filled - amin) * (0x0FFFFFF0 / (amax - amin))
+    load ()
 
     def getn ():
-        return n
+        return len (arrays)
 
     def getshapei (i):
         return w, h
@@ -1014,13 +1083,6 @@ def cycle (arrays, descs=None, cadence=0.6, toworlds=None,
     def getsurfacei (i, xoffset, yoffset, width, height):
         return surfaces[i], xoffset, yoffset
 
-    # see comment in view()
-    nomasks = [not np.ma.is_masked (a) or a.mask is np.ma.nomask
-               for a in arrays]
-
-    if toworlds is None:
-        toworlds = [None] * n
-
     from astutil import fmthours, fmtdeglat
     def fmtstatusi (i, x, y):
         s = ''
@@ -1050,4 +1112,21 @@ def cycle (arrays, descs=None, cadence=0.6, toworlds=None,
     cycler.win.show_all ()
     cycler.win.connect ('destroy', gtk.main_quit)
 
+    if getmore is not None:
+        def poll ():
+            more = getmore ()
+            if more is None:
+                return False
+
+            if len (more):
+                for array, desc, toworld in more:
+                    arrays.append (array)
+                    descs.append (desc)
+                    toworlds.append (toworld)
+                load ()
+                cycler.refresh ()
+            return True
+
+        glib.timeout_add (100, poll)
+
     gtk.main ()
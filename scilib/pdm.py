@@ -67,7 +67,108 @@ def one_theta (t, x, wt, period, nbin, nshift, v_all):
     return numer / (denom * v_all)
 
 
-def pdm (t, x, u, periods, nbin, nshift=8, nsmc=256, numc=256):
+def theta_block (t, x, wt, periods, nbin, nshift, v_all):
+    """Compute the theta statistic for a block of trial periods at once.
+
+    This is a vectorized equivalent of calling `one_theta` for each element
+    of `periods`. The phase bin of every sample for every (period, shift)
+    combination is computed with a single array operation, and the weighted
+    sums needed for the per-bin variances are accumulated with `np.bincount`.
+    Memory usage scales as periods.size * t.size * nshift, so callers with
+    large inputs should feed this function chunks of periods; see `thetas`.
+
+    We center `x` on its weighted mean before accumulating sums of squares,
+    which keeps the result consistent with `weighted_variance` to within
+    floating-point roundoff."""
+
+    periods = np.atleast_1d (np.asfarray (periods))
+    nper = periods.size
+    n = t.size
+    ncell = nshift * nbin
+
+    xc = x - (wt * x).sum () / wt.sum ()
+    wx = wt * xc
+    wxx = wx * xc
+
+    phase0 = t[np.newaxis,:] / periods[:,np.newaxis]
+    keys = np.empty ((nper, nshift, n), dtype=np.int)
+    base = np.arange (nper)[:,np.newaxis] * ncell
+
+    for i in xrange (nshift):
+        phase = (phase0 + float (i) / (nshift * nbin)) % 1.
+        keys[:,i] = np.floor (phase * nbin).astype (np.int)
+        keys[:,i] += base + i * nbin
+
+    keys = keys.ravel ()
+    nkeys = nper * ncell
+    reps = nper * nshift
+
+    cts = np.bincount (keys, minlength=nkeys)
+    sw = np.bincount (keys, weights=np.tile (wt, reps), minlength=nkeys)
+    swx = np.bincount (keys, weights=np.tile (wx, reps), minlength=nkeys)
+    swxx = np.bincount (keys, weights=np.tile (wxx, reps), minlength=nkeys)
+
+    # Per-bin contribution to the numerator is var * (n - 1), where var is
+    # the unbiased weighted variance computed by weighted_variance().
+
+    ok = cts >= 3
+    swok = np.where (ok, sw, 1.)
+    numer = np.where (ok, (swxx - swx**2 / swok) / swok * cts, 0.)
+    denom = np.where (ok, cts - 1, 0)
+
+    numer = numer.reshape ((nper, ncell)).sum (axis=1)
+    denom = denom.reshape ((nper, ncell)).sum (axis=1)
+    return numer / (denom * v_all)
+
+
+def all_thetas (t, x, wt, periods, nbin, nshift, v_all, blocksize=None):
+    """Compute theta values for every element of `periods`, invoking
+    `theta_block` on chunks of `blocksize` periods. If `blocksize` is None,
+    it is chosen to keep the working arrays to a few million elements."""
+
+    if blocksize is None:
+        blocksize = max (1, (1 << 22) // max (1, t.size * nshift))
+
+    result = np.empty (periods.shape)
+
+    for i in xrange (0, periods.size, blocksize):
+        result[i:i+blocksize] = theta_block (t, x, wt, periods[i:i+blocksize],
+                                             nbin, nshift, v_all)
+
+    return result
+
+
+def _mc_trial (state, kind, seed):
+    """Run one Monte Carlo trial. `kind` is 's' for a shuffle trial, which
+    returns the minimal theta, or 'u' for a noise-added trial, which returns
+    the best period. Each trial uses its own RNG seeded with `seed`, so results
+    do not depend on which process runs which trial."""
+
+    t, x, u, wt, periods, nbin, nshift, v_all = state
+    rs = np.random.RandomState (seed)
+
+    if kind == 's':
+        shuf = rs.permutation (x.size)
+        return all_thetas (t, x[shuf], wt[shuf], periods, nbin, nshift,
+                           v_all).min ()
+
+    noised = rs.normal (x, u)
+    mc_thetas = all_thetas (t, noised, wt, periods, nbin, nshift, v_all)
+    return periods[mc_thetas.argmin ()]
+
+
+_pool_state = None
+
+def _pool_init (state):
+    global _pool_state
+    _pool_state = state
+
+def _pool_trial (args):
+    return _mc_trial (_pool_state, *args)
+
+
+def pdm (t, x, u, periods, nbin, nshift=8, nsmc=256, numc=256, seed=None,
+         workers=1):
     """Perform phase dispersion minimization.
 
     `t` - 1D array - time coordinate
@@ -80,6 +181,13 @@ def pdm (t, x, u, periods, nbin, nshift=8, nsmc=256, numc=256):
        significance of the minimal theta value.
     `numc` - int=256 - number of Monte Carlo added-noise datasets to compute, to evaluate
        the uncertainty in the location of the minimal theta value.
+    `seed` - int or None - seed for the Monte Carlo trials. Each trial draws
+       from its own RNG stream derived from this value, so the results depend
+       only on `seed` and not on `workers`. If None, the per-trial seeds are
+       drawn from the global `np.random` state.
+    `workers` - int=1 - number of processes to use for the Monte Carlo trials.
+       If 1, everything runs in the current process; if None, one process per
+       CPU is used.
 
     Returns named tuple of:
 
@@ -95,8 +203,9 @@ def pdm (t, x, u, periods, nbin, nshift=8, nsmc=256, numc=256):
     `mc_puncert` - standard deviation of `mc_pmins`; approximate uncertainty
        on `pmin`.
 
-    We don't do anything clever, so runtime scales at least as
-      t.size * periods.size * nbin * nshift * (nsmc + numc + 1)."""
+    Theta values are computed in vectorized blocks of periods (see
+    `all_thetas`), but the amount of work still scales as
+      t.size * periods.size * nshift * (nsmc + numc + 1)."""
 
     t = np.asfarray (t)
     x = np.asfarray (x)
@@ -106,6 +215,7 @@ def pdm (t, x, u, periods, nbin, nshift=8, nsmc=256, numc=256):
     nbin = int (nbin)
     nshift = int (nshift)
     nsmc = int (nsmc)
+    numc = int (numc)
 
     if t.ndim != 1:
         raise ValueError ('`t` must be <= 1D')
@@ -128,51 +238,53 @@ def pdm (t, x, u, periods, nbin, nshift=8, nsmc=256, numc=256):
     if nsmc < 0:
         raise ValueError ('`nsmc` must be nonnegative')
 
+    if numc < 0:
+        raise ValueError ('`numc` must be nonnegative')
+
+    if workers is not None and workers < 1:
+        raise ValueError ('`workers` must be at least 1')
+
     # We can finally get started!
 
     wt = u ** -2
     v_all = weighted_variance (x, wt)
 
-    thetas = np.empty (periods.shape)
-
-    for i in xrange (periods.size):
-        thetas[i] = one_theta (t, x, wt, periods[i], nbin, nshift, v_all)
-
+    thetas = all_thetas (t, x, wt, periods, nbin, nshift, v_all)
     imin = thetas.argmin ()
     pmin = periods[imin]
 
-    # Now do the Monte Carlo jacknifing so that the caller can have some idea
-    # as to the significance of the minimal value of `thetas`. XXX: ripe for
-    # parallelization.
-
-    mc_thetas = np.empty (periods.shape)
-    mc_tmins = np.empty (nsmc)
-
-    for i in xrange (nsmc):
-        shuf = np.random.permutation (x.size)
-
-        for j in xrange (periods.size):
-            mc_thetas[j] = one_theta (t, x[shuf], wt[shuf], periods[j],
-                                      nbin, nshift, v_all)
-
-        mc_tmins[i] = mc_thetas.min ()
-
+    # Now do the Monte Carlo trials. First, the jacknifing so that the
+    # caller can have some idea as to the significance of the minimal value of
+    # `thetas`; then adding noise to assess the uncertainty of the period.
+    # The trials are independent and can be farmed out to a process pool.
+
+    if seed is None:
+        rs = np.random
+    else:
+        rs = np.random.RandomState (seed)
+
+    seeds = rs.randint (0, 2**31 - 1, nsmc + numc)
+
+    tasks = [('s', seeds[i]) for i in xrange (nsmc)]
+    tasks += [('u', seeds[nsmc + i]) for i in xrange (numc)]
+    state = (t, x, u, wt, periods, nbin, nshift, v_all)
+
+    if workers == 1 or len (tasks) < 2:
+        results = [_mc_trial (state, kind, s) for kind, s in tasks]
+    else:
+        from multiprocessing import Pool
+        pool = Pool (workers, _pool_init, (state, ))
+        try:
+            results = pool.map (_pool_trial, tasks)
+        finally:
+            pool.terminate ()
+            pool.join ()
+
+    mc_tmins = np.asarray (results[:nsmc], dtype=np.float)
     mc_tmins.sort ()
     mc_pvalue = mc_tmins.searchsorted (thetas[imin]) / nsmc
 
-    # Now add noise to assess the uncertainty of the period.
-
-    mc_pmins = np.empty (numc)
-
-    for i in xrange (numc):
-        noised = np.random.normal (x, u)
-
-        for j in xrange (periods.size):
-            mc_thetas[j] = one_theta (t, noised, wt, periods[j],
-                                      nbin, nshift, v_all)
-
-        mc_pmins[i] = periods[mc_thetas.argmin ()]
-
+    mc_pmins = np.asarray (results[nsmc:], dtype=np.float)
     mc_pmins.sort ()
     mc_puncert = mc_pmins.std ()
 
@@ -181,3 +293,30 @@ def pdm (t, x, u, periods, nbin, nshift=8, nsmc=256, numc=256):
     return PDMResult (thetas=thetas, imin=imin, pmin=pmin, mc_tmins=mc_tmins,
                       mc_pvalue=mc_pvalue, mc_pmins=mc_pmins,
                       mc_puncert=mc_puncert)
+
+
+def _scalar_thetas (t, x, wt, periods, nbin, nshift, v_all):
+    """The original one-period-at-a-time implementation, retained as a
+    reference for `_regression_test`."""
+    return np.asarray ([one_theta (t, x, wt, p, nbin, nshift, v_all)
+                        for p in periods])
+
+
+def _regression_test (n=200, nper=64, nbin=10, nshift=8, seed=0):
+    """Check that the vectorized theta engine agrees with the scalar
+    implementation on a synthetic noisy sinusoid."""
+
+    rs = np.random.RandomState (seed)
+    t = np.sort (rs.uniform (0, 100, n))
+    u = rs.uniform (0.5, 1.5, n)
+    x = np.sin (2 * np.pi * t / 7.3) + rs.normal (0, u)
+    wt = u ** -2
+    v_all = weighted_variance (x, wt)
+    periods = np.linspace (2, 20, nper)
+
+    ref = _scalar_thetas (t, x, wt, periods, nbin, nshift, v_all)
+    vec = all_thetas (t, x, wt, periods, nbin, nshift, v_all, blocksize=7)
+
+    from numpy.testing import assert_allclose
+    assert_allclose (vec, ref, rtol=1e-10)
+    assert vec.argmin () == ref.argmin ()
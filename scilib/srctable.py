@@ -319,7 +319,51 @@ def deconvolve (source, bmaj, bmin, bpa, minaxprod=0, preserve=True):
                                                   source.minor,
                                                   source.pa,
                                                   bmaj, bmin, bpa)
+    return _apply_deconvolution (source, dmaj, dmin, dpa, status, minaxprod)
 
+
+def deconvolve_many (sources, bmaj, bmin, bpa, minaxprod=0, preserve=True):
+    """Like deconvolve(), but for a sequence of sources, with all of the
+    deconvolutions done in one vectorized call. The beam parameters may
+    be scalars or arrays with one value per source. Returns a list of
+    the sources."""
+    sources = list (sources)
+    n = len (sources)
+    bmaj, bmin, bpa = [np.broadcast_to (np.asarray (x, dtype=np.double), (n, ))
+                       for x in (bmaj, bmin, bpa)]
+
+    todo = []
+
+    for i, source in enumerate (sources):
+        if not (has (source, 'major') and has (source, 'minor')
+                and has (source, 'pa')):
+            source.deconvolve_error = 'missing shape information'
+            continue
+
+        if preserve:
+            source.c_major = source.major
+            source.c_minor = source.minor
+            source.c_pa = source.pa
+
+        todo.append (i)
+
+    if not len (todo):
+        return sources
+
+    todo = np.asarray (todo)
+    shapes = np.asarray ([(sources[i].major, sources[i].minor, sources[i].pa)
+                          for i in todo]).T
+    dmaj, dmin, dpa, status = gaussianDeconvolve (shapes[0], shapes[1], shapes[2],
+                                                  bmaj[todo], bmin[todo], bpa[todo])
+
+    for j, i in enumerate (todo):
+        _apply_deconvolution (sources[i], float (dmaj[j]), float (dmin[j]),
+                              float (dpa[j]), str (status[j]), minaxprod)
+
+    return sources
+
+
+def _apply_deconvolution (source, dmaj, dmin, dpa, status, minaxprod):
     if status == 'fail':
         dmaj = dmin = dpa = None
         source.deconvolve_error = 'deconvolution failed'
@@ -359,19 +403,21 @@ def deconvolve (source, bmaj, bmin, bpa, minaxprod=0, preserve=True):
 # ndshow shouldn't depend on srctable, and I might want to reuse this
 # functionality interactively, so it shouldn't go in pwshow.
 
-def loadAsOverlay (source, topixel, imgheight):
+def loadAsOverlay (source, topixel, imgheight, many=False):
+    """If many is True, topixel maps an (N, 2) array of (lat, lon)
+    coordinates to (N, 2) pixel coordinates in one call, like
+    AstroImage.topixel_many; otherwise it maps one pair at a time."""
     headers, cols, recs = readtable (source, stmapping ())
-    compact = []
 
-    for rec in recs:
-        y, x = topixel ([rec.dec, rec.ra])
-
-        if not hasattr (rec, 'major') or rec.major is None or rec.major == 0:
-            compact.append ((x, y))
-            continue
+    if many:
+        world = np.asarray ([(rec.dec, rec.ra) for rec in recs], dtype=np.double)
+        pixels = topixel (world.reshape ((-1, 2)))
+    else:
+        pixels = [topixel ([rec.dec, rec.ra]) for rec in recs]
 
-        # TODO: draw Gaussians with the right shape
-        compact.append ((x, y))
+    # TODO: draw Gaussians with the right shape; extended sources
+    # (rec.major nonzero) are drawn as points for now.
+    compact = [(x, y) for y, x in pixels]
 
     def drawoverlay (ctxt, width, height, x0, y0, d2p):
         ctxt.set_source_rgb (255, 0, 0)
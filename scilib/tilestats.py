@@ -0,0 +1,287 @@
+# Copyright 2013 Peter Williams
+# Licensed under the GNU General Public License version 3 or higher
+
+"""tilestats - bounded-memory statistics of large images
+
+Images are read tile by tile through AstroImage.read_region(), and the
+pixels are fed into mergeable accumulators, so that whole wide-field
+images and spectral cubes can be characterized without ever holding
+more than one tile in memory:
+
+* Moments tracks the count, mean, variance, min, and max, merging
+  partial results with Chan et al.'s pairwise formulas.
+* QuantileSketch is an approximate quantile sketch in the style of
+  Manku-Rajagopalan-Lindsay/KLL: sorted buffers of at most k items at
+  levels of weight 2^h, with full levels compacted by keeping every
+  other item. Its rank error is roughly n * sqrt (log2 (n / k)) / k.
+* TileStats combines the two and also counts masked or non-finite
+  pixels, which are otherwise ignored.
+
+tiles() and plane_stats() iterate over an image; image_stats() reduces
+a whole image to one TileStats.
+"""
+
+import numpy as np
+
+__all__ = ('MAXPIX DEFAULT_K MAD2SIGMA Moments QuantileSketch TileStats '
+           'tiles plane_stats image_stats').split ()
+
+MAXPIX = 1 << 22 # max pixels per tile; 16 MB of float32
+DEFAULT_K = 4096 # sketch buffer size
+MAD2SIGMA = 1.482602218505602 # MAD -> sigma for a Gaussian
+
+
+class Moments (object):
+    __slots__ = 'n mean m2 min max'.split ()
+
+    def __init__ (self):
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = np.inf
+        self.max = -np.inf
+
+
+    def _combine (self, n, mean, m2, mn, mx):
+        if n == 0:
+            return self
+
+        ntot = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / ntot
+        self.m2 += m2 + delta**2 * self.n * n / ntot
+        self.n = ntot
+        self.min = min (self.min, mn)
+        self.max = max (self.max, mx)
+        return self
+
+
+    def add (self, x):
+        """x is a 1D array of finite values."""
+        if x.size == 0:
+            return self
+        mean = x.mean (dtype=np.double)
+        m2 = np.square (x - mean).sum ()
+        return self._combine (x.size, mean, m2, x.min (), x.max ())
+
+
+    def merge (self, other):
+        return self._combine (other.n, other.mean, other.m2, other.min, other.max)
+
+
+    @property
+    def var (self):
+        if self.n == 0:
+            return np.nan
+        return self.m2 / self.n
+
+    @property
+    def std (self):
+        return np.sqrt (self.var)
+
+    @property
+    def rms (self):
+        return np.sqrt (self.var + self.mean**2)
+
+
+class QuantileSketch (object):
+    def __init__ (self, k=DEFAULT_K, seed=0):
+        self.k = k
+        self._levels = [] # sorted arrays; items at level h have weight 2**h
+        self._rs = np.random.RandomState (seed)
+
+
+    @property
+    def n (self):
+        return sum (lv.size << h for h, lv in enumerate (self._levels))
+
+
+    def _insert (self, h, vals):
+        # vals must be sorted. Halving a sorted buffer leaves it sorted,
+        # so a big input cascades up the levels with only one sort.
+
+        while True:
+            while len (self._levels) <= h:
+                self._levels.append (np.empty (0))
+
+            cur = self._levels[h]
+            if cur.size:
+                vals = np.sort (np.concatenate ((cur, vals)))
+
+            if vals.size <= self.k:
+                self._levels[h] = vals
+                return
+
+            if vals.size % 2:
+                # Hold one item back so that the total weight stays exact.
+                self._levels[h] = vals[-1:]
+                vals = vals[:-1]
+            else:
+                self._levels[h] = vals[:0]
+
+            vals = vals[self._rs.randint (2)::2]
+            h += 1
+
+
+    def add (self, values):
+        values = np.asarray (values, dtype=np.double).ravel ()
+        if values.size:
+            self._insert (0, np.sort (values))
+        return self
+
+
+    def merge (self, other):
+        for h, lv in enumerate (other._levels):
+            if lv.size:
+                self._insert (h, lv)
+        return self
+
+
+    def _weighted (self):
+        items = []
+        weights = []
+
+        for h, lv in enumerate (self._levels):
+            items.append (lv)
+            weights.append (np.ones (lv.size) * 2.**h)
+
+        if not len (items):
+            return np.empty (0), np.empty (0)
+
+        items = np.concatenate (items)
+        weights = np.concatenate (weights)
+        s = np.argsort (items, kind='mergesort')
+        return items[s], weights[s]
+
+
+    @staticmethod
+    def _wquantile (items, weights, q):
+        if items.size == 0:
+            return np.nan * np.asarray (q)
+        cw = np.cumsum (weights)
+        pos = cw - 0.5 * weights
+        return np.interp (np.asarray (q) * cw[-1], pos, items)
+
+
+    def quantile (self, q):
+        """Approximate q'th quantile(s), 0 <= q <= 1."""
+        items, weights = self._weighted ()
+        return self._wquantile (items, weights, q)
+
+
+    def median (self):
+        return self.quantile (0.5)
+
+
+    def mad (self, center=None):
+        """Approximate median absolute deviation from center, which
+        defaults to the median. Computed from the sketch's own samples,
+        so it needs only one pass over the data."""
+        items, weights = self._weighted ()
+        if center is None:
+            center = self._wquantile (items, weights, 0.5)
+        dev = np.abs (items - center)
+        s = np.argsort (dev, kind='mergesort')
+        return self._wquantile (dev[s], weights[s], 0.5)
+
+
+class TileStats (object):
+    def __init__ (self, k=DEFAULT_K, seed=0):
+        self.moments = Moments ()
+        self.sketch = QuantileSketch (k, seed)
+        self.nbad = 0 # masked or non-finite
+
+
+    def add (self, data):
+        data = np.ma.asarray (data)
+        vals = data.compressed ()
+        vals = vals[np.isfinite (vals)]
+        self.nbad += data.size - vals.size
+        self.moments.add (vals)
+        self.sketch.add (vals)
+        return self
+
+
+    def merge (self, other):
+        self.moments.merge (other.moments)
+        self.sketch.merge (other.sketch)
+        self.nbad += other.nbad
+        return self
+
+
+    @property
+    def n (self):
+        return self.moments.n
+
+    @property
+    def min (self):
+        return self.moments.min
+
+    @property
+    def max (self):
+        return self.moments.max
+
+    @property
+    def mean (self):
+        return self.moments.mean
+
+    @property
+    def std (self):
+        return self.moments.std
+
+    @property
+    def rms (self):
+        return self.moments.rms
+
+    @property
+    def median (self):
+        return self.sketch.median ()
+
+    @property
+    def madsigma (self):
+        """Robust noise estimate: MAD scaled to a Gaussian sigma."""
+        return MAD2SIGMA * self.sketch.mad ()
+
+    def quantile (self, q):
+        return self.sketch.quantile (q)
+
+
+def tiles (img, maxpix=MAXPIX):
+    """Yield (planeidx, data) for tiles of img, where planeidx indexes
+    the axes before the last two and data is a masked array of whole
+    rows of that plane with at most maxpix pixels (but at least one
+    row)."""
+    if img.shape.size < 2:
+        yield (), img.read ()
+        return
+
+    h, w = img.shape[-2:]
+    nrows = max (maxpix // max (w, 1), 1)
+
+    for idx in np.ndindex (*img.shape[:-2]):
+        for y0 in xrange (0, h, nrows):
+            yield idx, img.read_region (idx + (slice (y0, y0 + nrows), ))
+
+
+def plane_stats (img, maxpix=MAXPIX, k=DEFAULT_K, seed=0):
+    """Yield (planeidx, TileStats) for each plane of img in order."""
+    cur = curidx = None
+
+    for idx, data in tiles (img, maxpix):
+        if idx != curidx:
+            if cur is not None:
+                yield curidx, cur
+            curidx = idx
+            cur = TileStats (k, seed)
+        cur.add (data)
+
+    if cur is not None:
+        yield curidx, cur
+
+
+def image_stats (img, maxpix=MAXPIX, k=DEFAULT_K, seed=0):
+    """Reduce all of img to one TileStats."""
+    total = TileStats (k, seed)
+    for idx, data in tiles (img, maxpix):
+        total.add (data)
+    return total
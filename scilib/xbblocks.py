@@ -15,7 +15,7 @@ uncertainties on the block heights (ditto).
 
 import numpy as np
 
-__all__ = ['nlogn binbblock ttbblock bsttbblock']
+__all__ = ['nlogn bbcumsums binbblock ttbblock bsttbblock']
 
 ## quickutil: holder
 #- snippet: holder.py (2012 Sep 29)
@@ -71,7 +71,98 @@ def nlogn (n, dt):
     return np.where (mask, 0, r)
 
 
-def binbblock (widths, counts, p0=0.05):
+def bbcumsums (widths, counts):
+    """Compute the cumulative-sum structure used by the optimal-partition
+    kernel. Callers that run `binbblock` repeatedly on the same cells can
+    compute this once and pass it in with the `cumsums` keyword."""
+
+    widths = np.asarray (widths)
+    counts = np.asarray (counts)
+
+    vedges = np.cumsum (np.concatenate (([0], widths))) # size: ncells + 1
+    ccounts = np.cumsum (np.concatenate (([0], counts)))
+
+    cs = Holder ()
+    cs.ncells = widths.size
+    cs.block_remainders = vedges[-1] - vedges # size: nedges = ncells + 1
+    cs.count_remainders = (ccounts[-1] - ccounts).astype (np.float)
+    return cs
+
+
+def _bbworkspace (ncells):
+    """Preallocate the buffers used by `_bbpartition`. They can be reused for
+    any number of calls on problems with up to `ncells` cells."""
+
+    ws = Holder ()
+    ws.tk = np.empty (ncells)
+    ws.nk = np.empty (ncells)
+    ws.fit = np.empty (ncells)
+    ws.mask = np.empty (ncells, dtype=np.bool)
+    ws.best = np.zeros (ncells)
+    ws.last = np.zeros (ncells, dtype=np.int)
+    ws.work = np.zeros (ncells, dtype=np.int)
+    return ws
+
+
+def _bbpartition (cs, ncp_prior, ws):
+    """The O(N^2) dynamic-programming core of the Bayesian Blocks algorithm.
+    Returns the indices of the first cell of each block in the optimal
+    partition. All of the inner-loop arithmetic happens in the preallocated
+    buffers of `ws`, in the same order of operations as `nlogn`, so the
+    results are bit-for-bit the same as the straightforward implementation.
+    """
+
+    ncells = cs.ncells
+    block_remainders = cs.block_remainders
+    count_remainders = cs.count_remainders
+    best = ws.best
+    last = ws.last
+
+    for r in xrange (ncells):
+        tk = ws.tk[:r+1]
+        nk = ws.nk[:r+1]
+        fit = ws.fit[:r+1]
+        mask = ws.mask[:r+1]
+
+        np.subtract (block_remainders[:r+1], block_remainders[r+1], out=tk)
+        np.subtract (count_remainders[:r+1], count_remainders[r+1], out=nk)
+
+        # Pluggable fitness expression, equivalent to nlogn (nk, tk):
+        np.equal (nk, 0, out=mask)
+        fit[:] = nk
+        np.copyto (fit, 1., where=mask)
+        np.log (fit, out=fit)
+        np.log (tk, out=tk)
+        fit -= tk
+        fit *= nk
+        np.copyto (fit, 0., where=mask)
+
+        # This incrementally penalizes partitions with more blocks:
+        fit -= ncp_prior
+        fit[1:] += best[:r]
+
+        imax = np.argmax (fit)
+        last[r] = imax
+        best[r] = fit[imax]
+
+    # different semantics than Scargle impl: our blockstarts is similar to
+    # their changepoints, but we always finish with blockstarts[0] = 0.
+
+    work = ws.work
+    workidx = 0
+    ind = last[ncells - 1]
+
+    while True:
+        work[workidx] = ind
+        workidx += 1
+        if ind == 0:
+            break
+        ind = last[ind - 1]
+
+    return work[:workidx][::-1].copy ()
+
+
+def binbblock (widths, counts, p0=0.05, cumsums=None):
     widths = np.asarray (widths)
     counts = np.asarray (counts)
     ncells = widths.size
@@ -84,54 +175,19 @@ def binbblock (widths, counts, p0=0.05):
     if p0 < 0 or p0 >= 1.:
         raise ValueError ('p0 must lie within [0, 1)')
 
-    vedges = np.cumsum (np.concatenate (([0], widths))) # size: ncells + 1
-    block_remainders = vedges[-1] - vedges # size: nedges = ncells + 1
-    ccounts = np.cumsum (np.concatenate (([0], counts)))
-    count_remainders = ccounts[-1] - ccounts
+    if cumsums is None:
+        cumsums = bbcumsums (widths, counts)
+    elif cumsums.ncells != ncells:
+        raise ValueError ('cumsums must be computed from the same cells')
 
+    ws = _bbworkspace (ncells)
     prev_blockstarts = None
-    best = np.zeros (ncells, dtype=np.float)
-    last = np.zeros (ncells, dtype=np.int)
 
     for _ in xrange (10):
         # Pluggable num-change-points prior-weight expression:
         ncp_prior = 4 - np.log (p0 / (0.0136 * ncells**0.478))
 
-        for r in xrange (ncells):
-            tk = block_remainders[:r+1] - block_remainders[r+1]
-            nk = count_remainders[:r+1] - count_remainders[r+1]
-
-            # Pluggable fitness expression:
-            try:
-                fit_vec = nlogn (nk, tk)
-            except:
-                print 'q', nk, tk
-                print 'r', widths, counts
-                raise
-
-            # This incrementally penalizes partitions with more blocks:
-            tmp = fit_vec - ncp_prior
-            tmp[1:] += best[:r]
-
-            imax = np.argmax (tmp)
-            last[r] = imax
-            best[r] = tmp[imax]
-
-        # different semantics than Scargle impl: our blockstarts is similar to
-        # their changepoints, but we always finish with blockstarts[0] = 0.
-
-        work = np.zeros (ncells, dtype=int)
-        workidx = 0
-        ind = last[-1]
-
-        while True:
-            work[workidx] = ind
-            workidx += 1
-            if ind == 0:
-                break
-            ind = last[ind - 1]
-
-        blockstarts = work[:workidx][::-1]
+        blockstarts = _bbpartition (cumsums, ncp_prior, ws)
 
         if prev_blockstarts is not None:
             if (blockstarts.size == prev_blockstarts.size and
@@ -172,16 +228,11 @@ def binbblock (widths, counts, p0=0.05):
     return info
 
 
-def ttbblock (tstarts, tstops, times, p0=0.05):
-    tstarts = np.asarray (tstarts)
-    tstops = np.asarray (tstops)
-    times = np.asarray (times)
-
-    if tstarts.size != tstops.size:
-        raise ValueError ('must have same number of starts and stops')
-
+def _ttvalidate (tstarts, tstops, times, p0):
     ngti = tstarts.size
 
+    if tstops.size != ngti:
+        raise ValueError ('must have same number of starts and stops')
     if ngti < 1:
         raise ValueError ('must have at least one goodtime interval')
     if np.any ((tstarts[1:] - tstarts[:-1]) <= 0):
@@ -196,12 +247,21 @@ def ttbblock (tstarts, tstops, times, p0=0.05):
         raise ValueError ('no times may be smaller than first tstart')
     if times.max () > tstops[-1]:
         raise ValueError ('no times may be larger than last tstop')
-    for i in xrange (1, ngti):
-        if np.where ((times > tstops[i-1]) & (times < tstarts[i]))[0].size:
-            raise ValueError ('no times may fall in goodtime gap #%d' % i)
+
+    # igti = index of the last GTI starting at or before each time. Given the
+    # checks above, a time lies in a gap iff it comes after that GTI's stop.
+    igti = np.searchsorted (tstarts, times, side='right') - 1
+    ingap = times > tstops[igti]
+    if ingap.any ():
+        raise ValueError ('no times may fall in goodtime gap #%d'
+                          % (igti[ingap][0] + 1))
     if p0 < 0 or p0 >= 1.:
         raise ValueError ('p0 must lie within [0, 1)')
 
+
+def _ttunique (times):
+    """Return the unique event times and the number of events at each one."""
+
     utimes, uidxs = np.unique (times, return_index=True)
     nunique = utimes.size
 
@@ -209,45 +269,62 @@ def ttbblock (tstarts, tstops, times, p0=0.05):
     counts[:-1] = uidxs[1:] - uidxs[:-1]
     counts[-1] = times.size - uidxs[-1]
     assert counts.sum () == times.size
+    return utimes, counts
 
-    # we grow these arrays with concats, which will perform badly with lots of
-    # GTIs. Not expected to be a big deal.
-    widths = np.empty (0)
-    ledges = np.empty (0)
-    redges = np.empty (0)
-
-    for i in xrange (ngti):
-        tstart, tstop = tstarts[i], tstops[i]
-
-        w = np.where ((utimes >= tstart) & (utimes <= tstop))[0]
-
-        if not w.size:
-            # No events during this goodtime! We have to insert a zero-count
-            # event block. This may break assumptions within binbblock()?
-
-            # j = idx of first event after this GTI
-            wafter = np.where (utimes > tstop)[0]
-            if wafter.size:
-                j = wafter[0]
-            else:
-                j = utimes.size
-            assert j == 0 or np.where (utimes < tstart)[0][-1] == j - 1
-
-            counts = np.concatenate ((counts[:j], [0], counts[j:]))
-            widths = np.concatenate ((widths, [tstop - tstart]))
-            ledges = np.concatenate ((ledges, [tstart]))
-            redges = np.concatenate ((redges, [tstop]))
-        else:
-            gtutimes = utimes[w]
-            midpoints = 0.5 * (gtutimes[1:] + gtutimes[:-1]) # size: n - 1
-            gtedges = np.concatenate (([tstart], midpoints, [tstop])) # size: n + 1
-            gtwidths = gtedges[1:] - gtedges[:-1] # size: n
-            assert gtwidths.sum () == tstop - tstart
-            widths = np.concatenate ((widths, gtwidths))
-            ledges = np.concatenate ((ledges, gtedges[:-1]))
-            redges = np.concatenate ((redges, gtedges[1:]))
-
-    assert counts.size == widths.size
+
+def _ttgtibounds (tstarts, tstops, utimes):
+    """The unique times within GTI #i are utimes[lo[i]:hi[i]]."""
+    lo = np.searchsorted (utimes, tstarts, side='left')
+    hi = np.searchsorted (utimes, tstops, side='right')
+    return lo, hi
+
+
+def _ttcells (tstarts, tstops, utimes, counts, lo, hi):
+    """Construct the cells used in the time-tagged analysis. Returns
+    `(widths, ledges, redges, counts)`, where the returned counts include
+    zeros for GTIs that contain no events.
+
+    Each unique time gets a cell bounded by the midpoints to its neighbors,
+    or by the GTI edges if it is the first or last time within its GTI. Each
+    GTI without any events gets one zero-count cell spanning the whole GTI.
+    Everything is computed in one vectorized pass."""
+
+    nunique = utimes.size
+    nev = hi - lo
+    empty = (nev == 0)
+    full = ~empty
+    assert nev.sum () == nunique
+
+    # Cell index of each unique time = its own index plus the number of
+    # zero-count cells inserted before it.
+    nzbefore = np.cumsum (empty) - empty
+    evpos = np.arange (nunique) + np.repeat (nzbefore, nev)
+    zpos = lo[empty] + nzbefore[empty]
+
+    midpoints = 0.5 * (utimes[1:] + utimes[:-1]) # size: nunique - 1
+    evledges = np.empty (nunique)
+    evledges[1:] = midpoints
+    evledges[lo[full]] = tstarts[full]
+    evredges = np.empty (nunique)
+    evredges[:-1] = midpoints
+    evredges[hi[full] - 1] = tstops[full]
+
+    ncells = nunique + zpos.size
+    ledges = np.empty (ncells)
+    redges = np.empty (ncells)
+    cellcounts = np.zeros (ncells)
+
+    ledges[evpos] = evledges
+    redges[evpos] = evredges
+    cellcounts[evpos] = counts
+    ledges[zpos] = tstarts[empty]
+    redges[zpos] = tstops[empty]
+
+    widths = redges - ledges
+    return widths, ledges, redges, cellcounts
+
+
+def _ttinfo (widths, ledges, redges, counts, p0):
     info = binbblock (widths, counts, p0=p0)
     info.ledges = ledges[info.blockstarts]
     # The right edge of the i'th block is the right edge of its rightmost
@@ -257,7 +334,65 @@ def ttbblock (tstarts, tstops, times, p0=0.05):
     return info
 
 
-def bsttbblock (times, tstarts, tstops, p0=0.05, nbootstrap=512):
+def ttbblock (tstarts, tstops, times, p0=0.05):
+    tstarts = np.asarray (tstarts)
+    tstops = np.asarray (tstops)
+    times = np.asarray (times)
+
+    _ttvalidate (tstarts, tstops, times, p0)
+    utimes, counts = _ttunique (times)
+    lo, hi = _ttgtibounds (tstarts, tstops, utimes)
+    widths, ledges, redges, counts = _ttcells (tstarts, tstops, utimes,
+                                               counts, lo, hi)
+    return _ttinfo (widths, ledges, redges, counts, p0)
+
+
+def _bstrial (state, seed):
+    """Perform one bootstrap resampling. Rather than resampling and re-sorting
+    the event times, we draw the number of events at each unique time from the
+    appropriate multinomial distribution, which is equivalent. The GTI
+    validation and the GTI membership of each unique time are computed only
+    once, by the caller."""
+
+    tstarts, tstops, utimes, ucounts, lo, hi, p0, midpoints = state
+    rs = np.random.RandomState (seed)
+    nevents = int (ucounts.sum ())
+
+    bscounts = rs.multinomial (nevents, ucounts / nevents)
+    keep = bscounts > 0
+    ckeep = np.concatenate (([0], np.cumsum (keep)))
+
+    widths, ledges, redges, counts = _ttcells (tstarts, tstops, utimes[keep],
+                                               bscounts[keep].astype (np.float),
+                                               ckeep[lo], ckeep[hi])
+    bsinfo = _ttinfo (widths, ledges, redges, counts, p0)
+    blocknums = np.minimum (np.searchsorted (bsinfo.redges, midpoints),
+                            bsinfo.nblocks - 1)
+    return bsinfo.rates[blocknums]
+
+
+_pool_state = None
+
+def _pool_init (state):
+    global _pool_state
+    _pool_state = state
+    np.seterr ('raise')
+
+def _pool_trial (seed):
+    return _bstrial (_pool_state, seed)
+
+
+def bsttbblock (times, tstarts, tstops, p0=0.05, nbootstrap=512, seed=None,
+                workers=1):
+    """Bayesian Blocks analysis of time-tagged events with bootstrap-resampled
+    uncertainties on the block rates.
+
+    `seed` seeds the bootstrap resamplings; each resampling gets its own RNG
+    stream, so the results depend only on `seed` and not on `workers`. If
+    None, the per-resampling seeds are drawn from the global `np.random`
+    state. `workers` is the number of processes across which to spread the
+    resamplings; if None, one per CPU is used."""
+
     np.seterr ('raise')
     times = np.asarray (times)
     tstarts = np.asarray (tstarts)
@@ -266,22 +401,42 @@ def bsttbblock (times, tstarts, tstops, p0=0.05, nbootstrap=512):
     nevents = times.size
     if nevents < 1:
         raise ValueError ('must be given at least 1 event')
+    if workers is not None and workers < 1:
+        raise ValueError ('workers must be at least 1')
 
-    info = ttbblock (tstarts, tstops, times, p0)
+    _ttvalidate (tstarts, tstops, times, p0)
+    utimes, ucounts = _ttunique (times)
+    lo, hi = _ttgtibounds (tstarts, tstops, utimes)
+    widths, ledges, redges, counts = _ttcells (tstarts, tstops, utimes,
+                                               ucounts, lo, hi)
+    info = _ttinfo (widths, ledges, redges, counts, p0)
 
     # Now bootstrap resample to assess uncertainties on the bin heights. This
     # is the approach recommended by Scargle+.
 
+    if seed is None:
+        rs = np.random
+    else:
+        rs = np.random.RandomState (seed)
+
+    seeds = rs.randint (0, 2**31 - 1, nbootstrap)
+    state = (tstarts, tstops, utimes, ucounts, lo, hi, p0, info.midpoints)
+
+    if workers == 1 or nbootstrap < 2:
+        results = [_bstrial (state, s) for s in seeds]
+    else:
+        from multiprocessing import Pool
+        pool = Pool (workers, _pool_init, (state, ))
+        try:
+            results = pool.map (_pool_trial, seeds)
+        finally:
+            pool.terminate ()
+            pool.join ()
+
     bsrsums = np.zeros (info.nblocks)
     bsrsumsqs = np.zeros (info.nblocks)
 
-    for _ in xrange (nbootstrap):
-        bstimes = times[np.random.randint (0, times.size, times.size)]
-        bstimes.sort ()
-        bsinfo = ttbblock (tstarts, tstops, bstimes, p0)
-        blocknums = np.minimum (np.searchsorted (bsinfo.redges, info.midpoints),
-                                bsinfo.nblocks - 1)
-        samprates = bsinfo.rates[blocknums]
+    for samprates in results:
         bsrsums += samprates
         bsrsumsqs += samprates**2
 